@@ -3,12 +3,14 @@ from google.adk.runners import Runner
 from google.adk.models.google_llm import Gemini
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.sessions import InMemorySessionService
-from orchestrator_agent.document_parser_agent import parse_medical_document
+from orchestrator_agent.document_parser_agent import parse_medical_document, UPLOADS_DIR
 from orchestrator_agent.fair_price_research_agent import fair_price_research_agent
+from orchestrator_agent.line_item_analysis_agent import LineItemAnalysisAgent
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.plugins.save_files_as_artifacts_plugin import SaveFilesAsArtifactsPlugin
 from google.adk.tools import ToolContext, load_artifacts 
 from google.adk.tools import agent_tool
+from google.adk.events import Event
 from dotenv import load_dotenv
 from orchestrator_agent.insurance_advocate_agent import insurance_advocate_agent
 import google.genai.types as types
@@ -68,8 +70,8 @@ async def process_user_file(tool_context: ToolContext) -> dict:
     d = {'has_files': False, 'message': '', 'folder_path': '', 'file_count': 0}
 
     try:
-        # Create uploads directory if it doesn't exist
-        os.makedirs("orchestrator_agent/uploads", exist_ok=True)
+        # Each invocation gets its own folder so concurrent sessions don't mix files
+        folder_path = os.path.join(UPLOADS_DIR, tool_context.invocation_id)
         
         # Get list of artifacts - MUST USE AWAIT
         artifacts = await tool_context.list_artifacts()
@@ -77,17 +79,18 @@ async def process_user_file(tool_context: ToolContext) -> dict:
         if not artifacts or len(artifacts) == 0:
             d['message'] = "No files were uploaded with this message."
             return d
+        os.makedirs(folder_path, exist_ok=True)
         print(f"Found {len(artifacts)} uploaded file(s). Saving...")
         saved_files = []
         for artifact in artifacts:
             try:
                 # Load artifact - MUST USE AWAIT
                 artifact_content = await tool_context.load_artifact(filename=artifact)
-                file_name = artifact_content.inline_data.display_name 
+                file_name = os.path.basename(artifact_content.inline_data.display_name or artifact)
                 data_bytes = artifact_content.inline_data.data
                 
                 # Save to disk
-                file_path = os.path.join("orchestrator_agent/uploads", file_name)
+                file_path = os.path.join(folder_path, file_name)
                 with open(file_path, 'wb') as f:
                     f.write(data_bytes)
                 saved_files.append(file_name)
@@ -98,8 +101,8 @@ async def process_user_file(tool_context: ToolContext) -> dict:
         d['has_files'] = True
         d['file_count'] = len(saved_files)
         d['message'] = f"Successfully saved {len(saved_files)} file(s): {', '.join(saved_files)}"
-        d['folder_path'] = "orchestrator_agent/uploads"
-        tool_context
+        d['folder_path'] = folder_path
+        tool_context.state["upload_folder"] = folder_path
         return d
 
     except Exception as e:
@@ -107,55 +110,95 @@ async def process_user_file(tool_context: ToolContext) -> dict:
         return d
 
 
+def partial_results(event: Event) -> list[dict]:
+    '''
+    Returns the structured per-charge / per-denial results carried by a runner event.
+
+    Arguments:
+        event: An event from runner.run_async().
+
+    Returns:
+        List of {"line_type": "charge" | "denial", "input": {...}, "analysis": {...}}
+    '''
+    partial = (event.custom_metadata or {}).get("partial_result")
+    return [partial] if isinstance(partial, dict) else []
+
 
 model = "gemini-2.5-flash-lite"
 APP_NAME = "medical_advocate_orchestrator_agent"
 
-root_agent = LlmAgent(
-    name="medical_advocate_orchestrator_agent",
-    model=Gemini(model=model), 
-    description="Orchestrator Agent to help answer questions & co-ordinate with patients",
+intake_agent = LlmAgent(
+    name="intake_agent",
+    model=Gemini(model=model),
+    description="Saves and parses the documents uploaded by the patient",
     instruction="""
-You are a medical billing advocate orchestrator.
+You are the intake step of a medical billing advocate.
 
 WORKFLOW:
 
 Step 1: Call process_user_file()
-Step 2: Call parse_medical_document()
-Step 3: Based on the output, call the appropriate agents:
-    - If only medical bill: call fair_price_research_agent
-    - If only denial letter: call insurance_advocate_agent
-    - If both: call fair_price_research_agent AND insurance_advocate_agent one after the other
-
-Step 4: After all agent tools have run, you MUST:
-    - Collect the responses from each agent
+Step 2: If files were saved, call parse_medical_document()
+Step 3: Reply with ONE short line saying which documents were found (or that no files were uploaded). Do not analyze them - the charges and denials are analyzed next.
+""",
+    tools=[
+        process_user_file,
+        parse_medical_document,
+    ],
+)
+
+# Runs fair_price_research_agent per charge and insurance_advocate_agent per
+# denied service concurrently, streaming each result as it finishes
+line_item_analysis_agent = LineItemAnalysisAgent(
+    name="line_item_analysis_agent",
+    description="Analyzes every charge and denied service from the parsed documents",
+    charge_agent=fair_price_research_agent,
+    denial_agent=insurance_advocate_agent,
+)
+
+summary_agent = LlmAgent(
+    name="summary_agent",
+    model=Gemini(model=model),
+    description="Summarizes the per-charge and per-denial results for the patient",
+    instruction="""
+You are a medical billing advocate. The patient's charges and denied services have already been analyzed one by one.
+
+Per-charge results (from fair_price_research_agent):
+{charge_results?}
+
+Per-denial results (from insurance_advocate_agent):
+{denial_results?}
+
+You MUST:
+    - Compute the bill totals (billed, Medicare, commercial, overcharge) and an overall verdict from the per-charge results
+    - Combine the per-denial results into one appeal strategy and list of next steps
     - Present a final, clear, organized summary to the user
     - Include both the price analysis and the denial/appeal analysis
     - Use headings, bullet points, and formatting for clarity
+    - If no new documents were uploaded, answer the user's question using the results above
 
 **Example Final Output:**
 
 ---
 **Medical Bill Price Analysis**
-[Paste the output from fair_price_research_agent here]
+[Table of every charge analyzed by fair_price_research_agent, followed by the totals and overall verdict]
 
 ---
 **Insurance Denial & Appeal Analysis**
-[Paste the output from insurance_advocate_agent here]
+[Verdict for every denied service from insurance_advocate_agent, followed by the combined appeal strategy and next steps]
 
 **Medical Bill and Insurance denial uploaded together**
 [Paste the summary of both fair_price_research_agent and insurance_advocate_agent here]
 
 ---
 
-Always present BOTH analyses if both documents were uploaded. Do not skip or merge them. Your job is to coordinate and summarize the results for the user.
+Always present BOTH analyses if both documents were uploaded. Do not skip or merge them.
 """,
-    tools=[
-        process_user_file, 
-        parse_medical_document,
-        agent_tool.AgentTool(agent=fair_price_research_agent),
-        agent_tool.AgentTool(agent=insurance_advocate_agent)
-    ]
+)
+
+root_agent = SequentialAgent(
+    name="medical_advocate_orchestrator_agent",
+    description="Orchestrator Agent to help answer questions & co-ordinate with patients",
+    sub_agents=[intake_agent, line_item_analysis_agent, summary_agent],
 )
 
 
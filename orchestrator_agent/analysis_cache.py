@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import Any, Optional
+
+from google.adk.agents import LlmAgent
+from google.adk.agents.callback_context import CallbackContext
+import google.genai.types as types
+
+from orchestrator_agent.document_parser_agent import _parse_json_response
+
+CACHE_PATH = os.getenv("MEDIBILL_ANALYSIS_CACHE_PATH", "orchestrator_agent/cache/analysis_cache.sqlite")
+CACHE_TTL_SECONDS = float(os.getenv("MEDIBILL_ANALYSIS_CACHE_TTL_HOURS", "168")) * 3600
+CACHE_ENABLED = os.getenv("MEDIBILL_ANALYSIS_CACHE", "1") != "0"
+
+# Bump when the fingerprint or the stored format changes
+CACHE_FORMAT_VERSION = 2
+
+# Fields that identify the patient or the specific claim. They are left out of
+# the fingerprint, and their values are masked in stored analyses so a hit for
+# one patient never shows another patient's details.
+PATIENT_FIELDS = (
+    "patient_name",
+    "patient_id",
+    "claim_number",
+    "policy_number",
+    "date_of_service",
+    "denial_date",
+    "due_date",
+    "appeal_deadline",
+)
+
+# Per-patient or bookkeeping fields that don't change the analysis
+IGNORED_FIELDS = PATIENT_FIELDS + (
+    "amount_paid",
+    "amount_due",
+    "total_patient_responsibility",
+    "processed_files",
+    "source_files",
+    "validation_issues",
+)
+
+
+def _canonical(value: Any) -> Any:
+    """Normalize a parsed value so trivially different documents hash the same"""
+    if isinstance(value, dict):
+        return {
+            k: _canonical(v)
+            for k, v in sorted(value.items())
+            if k not in IGNORED_FIELDS and v is not None
+        }
+    if isinstance(value, list):
+        items = [_canonical(v) for v in value]
+        # Line items are order-independent
+        return sorted(items, key=lambda v: json.dumps(v, sort_keys=True))
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 2)
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return value
+
+
+def fingerprint_document(document: dict) -> str:
+    """Stable hash of an agent input or parsed document, excluding patient identifiers"""
+    canonical = json.dumps(_canonical(document), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def prompt_version(agent: LlmAgent) -> str:
+    """Version tied to the agent prompt and model, so prompt edits invalidate old entries"""
+    model_name = getattr(agent.model, "model", agent.model)
+    source = f"{CACHE_FORMAT_VERSION}|{agent.name}|{model_name}|{agent.instruction}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+def _placeholder(field: str) -> str:
+    return "{{" + field + "}}"
+
+
+def _mask_value(value: Any, request: dict, key: Optional[str] = None) -> Any:
+    if isinstance(value, dict):
+        return {k: _mask_value(v, request, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_mask_value(v, request) for v in value]
+    if not isinstance(value, str):
+        return value
+    if key in PATIENT_FIELDS and value.strip():
+        return _placeholder(key)
+    if value.startswith("http"):
+        return value
+    for field in PATIENT_FIELDS:
+        known = request.get(field)
+        if isinstance(known, str) and len(known.strip()) >= 3:
+            # Whole tokens only, so "000" never matches inside "$1,000" or "A000-1"
+            pattern = rf"(?<![\w$/-])(?<!\w[.,]){re.escape(known.strip())}(?![\w/-])(?![.,]\w)"
+            value = re.sub(pattern, lambda _: _placeholder(field), value)
+    return value
+
+
+def _unmask_value(value: Any, request: dict) -> Any:
+    if isinstance(value, dict):
+        return {k: _unmask_value(v, request) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unmask_value(v, request) for v in value]
+    if not isinstance(value, str):
+        return value
+    for field in PATIENT_FIELDS:
+        known = request.get(field)
+        value = value.replace(_placeholder(field), known if isinstance(known, str) and known else "N/A")
+    return value
+
+
+def _mask_patient_fields(analysis: dict, request: dict) -> str:
+    """Stored form of an analysis, with the request's patient fields replaced by placeholders"""
+    return json.dumps(_mask_value(analysis, request))
+
+
+def _unmask_patient_fields(stored: str, request: dict) -> str:
+    return json.dumps(_unmask_value(json.loads(stored), request))
+
+
+class AnalysisCache:
+    """SQLite-backed cache of finished agent analyses keyed by document fingerprint"""
+
+    def __init__(self, path: str = CACHE_PATH, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS analyses (
+                    agent_name TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    analysis TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (agent_name, version, fingerprint)
+                )"""
+            )
+        # Expired rows are never served, so drop them instead of letting the file grow
+        self.purge_expired()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    def get(self, agent_name: str, version: str, fingerprint: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT analysis, created_at FROM analyses WHERE agent_name = ? AND version = ? AND fingerprint = ?",
+                (agent_name, version, fingerprint),
+            ).fetchone()
+        if row is None:
+            return None
+        analysis, created_at = row
+        if time.time() - created_at > self.ttl_seconds:
+            return None
+        return analysis
+
+    def put(self, agent_name: str, version: str, fingerprint: str, analysis: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?)",
+                (agent_name, version, fingerprint, analysis, time.time()),
+            )
+
+    def purge_expired(self) -> int:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM analyses WHERE created_at < ?",
+                (time.time() - self.ttl_seconds,),
+            )
+        return cursor.rowcount
+
+
+def structured_request(callback_context: CallbackContext) -> Optional[dict]:
+    """Return the agent's JSON input (sent by AgentTool for agents with an input_schema)"""
+    content = callback_context.user_content
+    if content is None or not content.parts:
+        return None
+    text = "".join(part.text or "" for part in content.parts)
+    try:
+        request = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return request if isinstance(request, dict) else None
+
+
+def chain_callback(agent: LlmAgent, field: str, callback) -> None:
+    """Add a callback after any already set on agent.<field>"""
+    existing = getattr(agent, field)
+    if existing is None:
+        existing = []
+    elif not isinstance(existing, list):
+        existing = [existing]
+    setattr(agent, field, existing + [callback])
+
+
+def attach_analysis_cache(agent: LlmAgent, cache: Optional[AnalysisCache] = None) -> LlmAgent:
+    """
+    Serve repeat analyses of the same input (one charge or denied service) from the cache.
+
+    On a hit the stored analysis is returned as the agent's response and the
+    search-and-reason run is skipped. On a miss the agent runs normally and its
+    final output (read from agent.output_key) is stored if it is a JSON object.
+
+    Arguments:
+        agent: The agent to cache. Must have an input_schema and an output_key.
+        cache: Cache to use. Defaults to one at MEDIBILL_ANALYSIS_CACHE_PATH.
+    """
+    if not CACHE_ENABLED:
+        return agent
+
+    cache = cache or AnalysisCache()
+    version = prompt_version(agent)
+
+    def before_agent_callback(callback_context: CallbackContext) -> Optional[types.Content]:
+        request = structured_request(callback_context)
+        if request is None:
+            return None
+
+        try:
+            analysis = cache.get(agent.name, version, fingerprint_document(request))
+        except sqlite3.Error as e:
+            print(f"⚠️ Warning: Analysis cache lookup failed: {e}")
+            return None
+        if analysis is None:
+            return None
+
+        print(f"⚡ Analysis cache hit for {agent.name}")
+        analysis = _unmask_patient_fields(analysis, request)
+        callback_context.state[agent.output_key] = analysis
+        return types.Content(role="model", parts=[types.Part(text=analysis)])
+
+    def after_agent_callback(callback_context: CallbackContext) -> None:
+        request = structured_request(callback_context)
+        analysis = callback_context.state.get(agent.output_key)
+        if request is None or not isinstance(analysis, str):
+            return None
+        # Errors, refusals and truncated output would otherwise be served for the whole TTL
+        try:
+            parsed = _parse_json_response(analysis)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(parsed, dict):
+            return None
+
+        try:
+            cache.put(agent.name, version, fingerprint_document(request), _mask_patient_fields(parsed, request))
+        except sqlite3.Error as e:
+            print(f"⚠️ Warning: Could not store analysis in cache: {e}")
+        return None
+
+    chain_callback(agent, "before_agent_callback", before_agent_callback)
+    chain_callback(agent, "after_agent_callback", after_agent_callback)
+    return agent
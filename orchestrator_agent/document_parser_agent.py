@@ -1,17 +1,22 @@
 from google import genai
 import os
-from pydantic import BaseModel, Field
-from typing import Dict, Any, Union
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, Any, Optional, Union
 from dotenv import load_dotenv
 from google.genai import types
 import json 
+import asyncio
+import shutil
 from google.adk.artifacts import InMemoryArtifactService
+from google.adk.tools import ToolContext
 load_dotenv()
 
 client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
 
 model = "gemini-2.5-flash"
 
+UPLOADS_DIR = "orchestrator_agent/uploads"
+
 class Charge(BaseModel):
     code : str = Field(description="The medical service code",default="99215")
     description : str = Field(description="Description of the medical service",default="Office visit - Level 5")
@@ -62,18 +67,259 @@ class DenialLetter(BaseModel):
     appeal_deadline : str = Field(description="Deadline to file an appeal")
     appeal_instructions : str = Field(description="Instructions on how to file an appeal")
 
+DOCUMENT_SCHEMAS = {
+    "medical_bill": MedicalBill,
+    "insurance_eob": InsuranceEOB,
+    "denial_letter": DenialLetter,
+}
+
 # Create the root agent - this is the entry point
-def _parse_json_response(text: str) -> dict:
-    """Extract and parse JSON from model response"""
-    # Remove markdown code blocks if present
+def _strip_code_fences(text: str) -> str:
+    """Remove markdown code fences, including an unterminated trailing fence"""
     if "```json" in text:
-        text = text.split("```json")[1].split("```")[0].strip()
+        text = text.split("```json", 1)[1]
     elif "```" in text:
-        text = text.split("```")[1].split("```")[0].strip()
-    
-    # Parse JSON
-    return json.loads(text)
+        text = text.split("```", 1)[1]
+    return text.split("```", 1)[0].strip()
+
+
+def _close_truncated_json(text: str) -> Any:
+    """Cut truncated JSON back to its last complete value and close open brackets"""
+    stack = []
+    cut_points = []  # (index, open brackets at that point)
+    in_string = False
+    escaped = False
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in "[{":
+            stack.append(ch)
+        elif ch in "]}":
+            if not stack:
+                break
+            stack.pop()
+            cut_points.append((i + 1, list(stack)))
+            if not stack:
+                break
+        elif ch == ",":
+            cut_points.append((i, list(stack)))
+
+    closers = {"[": "]", "{": "}"}
+    for index, open_brackets in reversed(cut_points):
+        candidate = text[:index].rstrip().rstrip(",")
+        candidate += "".join(closers[b] for b in reversed(open_brackets))
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+
+    raise json.JSONDecodeError("Could not recover truncated JSON", text, 0)
+
+
+def _parse_json_response(text: str) -> Any:
+    """Extract and parse JSON from model response, recovering truncated output"""
+    return _parse_json_response_with_truncation(text)[0]
+
+
+def _parse_json_response_with_truncation(text: str) -> tuple[Any, bool]:
+    """
+    Like _parse_json_response, but also says whether the response was truncated.
+
+    Recovery cuts back to the last complete value, so a truncated response has
+    lost data: the end of its last document and any documents after it.
+    """
+    # Remove markdown code blocks if present
+    text = _strip_code_fences(text)
+
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError as e:
+        original_error = e
+
+    # Skip any chatter before the first [ or {
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+    if not starts:
+        raise original_error
+    text = text[min(starts):]
+
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+
+    try:
+        recovered = _close_truncated_json(text)
+    except json.JSONDecodeError:
+        raise original_error
+    print("🩹 Recovered truncated JSON response")
+    return recovered, True
+
+
+def _validate_document(doc: dict) -> list[dict]:
+    """
+    Validate a parsed document against its schema.
+
+    Returns a list of problems, one per top-level field that is missing or
+    invalid, e.g. [{"field": "city", "error": "Field required"}]. An explicit
+    null is not a problem: the prompt asks for null when a field isn't on the
+    document, so another look at the page wouldn't find it either.
+
+    A medical bill whose charges don't add up to total_billed is also a
+    problem, since charges may have been dropped.
+    """
+    schema = DOCUMENT_SCHEMAS.get(doc.get("document_type"))
+    if schema is None:
+        return []
+
+    problems = {}
+    try:
+        schema.model_validate(doc)
+    except ValidationError as e:
+        for error in e.errors():
+            if error["input"] is None and error["type"] != "missing":
+                continue
+            field = str(error["loc"][0]) if error["loc"] else "__root__"
+            location = ".".join(str(part) for part in error["loc"])
+            problems.setdefault(field, f"{location}: {error['msg']}")
+
+    if doc.get("document_type") == "medical_bill" and "charges" not in problems:
+        mismatch = _charges_total_mismatch(doc)
+        if mismatch:
+            problems["charges"] = mismatch
+            problems.setdefault("total_billed", mismatch)
+    return [{"field": field, "error": message} for field, message in problems.items()]
+
+
+def _charges_total_mismatch(bill: dict) -> Optional[str]:
+    """Describe a gap between the sum of the charges and total_billed, if there is one"""
+    charges = bill.get("charges")
+    total = bill.get("total_billed")
+    if not isinstance(charges, list) or not isinstance(total, (int, float)) or isinstance(total, bool):
+        return None
+    amounts = [c.get("amount") if isinstance(c, dict) else None for c in charges]
+    if not all(isinstance(a, (int, float)) and not isinstance(a, bool) for a in amounts):
+        return None
+    if abs(sum(amounts) - total) <= 0.01:
+        return None
+    return f"charges: {len(amounts)} charge(s) sum to {sum(amounts):.2f} but total_billed is {total:.2f}"
+
+
+def _extract_response_text(response) -> str:
+    """Get the text out of a generate_content response"""
+    if hasattr(response, 'text') and response.text:
+        return response.text
+    if hasattr(response, 'candidates') and len(response.candidates) > 0:
+        return response.candidates[0].content.parts[0].text
+    return ""
+
+
+def _repair_fields(doc: dict, problems: list[dict], image_files: list[str]) -> dict:
+    """
+    Ask the model for only the missing/invalid fields of one document.
 
+    Only the pages the document came from are sent when the model reported
+    them in "source_files"; otherwise all pages are sent.
+    """
+    schema = DOCUMENT_SCHEMAS[doc["document_type"]].model_json_schema()
+    fields = [p["field"] for p in problems]
+    field_schemas = {
+        name: schema["properties"][name]
+        for name in fields
+        if name in schema.get("properties", {})
+    }
+
+    source_files = set(doc.get("source_files") or [])
+    pages = [f for f in image_files if os.path.basename(f) in source_files] or image_files
+
+    prompt = f"""A {doc["document_type"]} was extracted from the attached page(s), but these fields are missing or invalid:
+
+{json.dumps(problems, indent=2)}
+
+Field schemas:
+{json.dumps(field_schemas, indent=2)}
+
+Shared definitions:
+{json.dumps(schema.get("$defs", {}), indent=2)}
+
+Look at the page(s) again and return a single JSON object containing ONLY these keys: {", ".join(fields)}.
+- For dates: use "YYYY-MM-DD" format
+- For amounts: use numbers only (no $ symbols)
+- NO markdown, NO explanations
+
+Start your response with {{ - nothing else.
+"""
+
+    parts = []
+    for file_path in pages:
+        parts.append({"inline_data": {"mime_type": _get_mime_type(file_path), "data": _read_file(file_path)}})
+    parts.append({"text": prompt})
+
+    print(f"🔧 Repairing {doc['document_type']} fields {fields} from {[os.path.basename(f) for f in pages]}")
+
+    response = client.models.generate_content(
+        model=model,
+        contents=[{"role": "user", "parts": parts}]
+    )
+    repaired = _parse_json_response(_extract_response_text(response))
+    if not isinstance(repaired, dict):
+        return {}
+    return {k: v for k, v in repaired.items() if k in fields}
+
+
+def _repair_json_text(response_text: str) -> Any:
+    """Ask the model to turn unparseable output back into JSON, without resending images"""
+    prompt = f"""The following text was meant to be JSON describing medical documents, but it is malformed.
+Fix the syntax and return ONLY the valid JSON (an object or an array), keeping every value that is present.
+Do not add markdown or explanations.
+
+{response_text}
+"""
+    print("🔧 Repairing malformed JSON (text-only call)")
+    response = client.models.generate_content(
+        model=model,
+        contents=[{"role": "user", "parts": [{"text": prompt}]}]
+    )
+    return _parse_json_response(_extract_response_text(response))
+
+
+def _validate_and_repair(doc: dict, image_files: list[str], cut_field: Optional[str] = None) -> dict:
+    """
+    Validate a document and repair only the failing fields with a small follow-up call.
+
+    cut_field is the field a truncated response stopped in. It may still
+    validate with part of its value missing (e.g. a shorter charges list), so
+    it is always repaired.
+    """
+    problems = _validate_document(doc)
+    if cut_field and cut_field not in {p["field"] for p in problems}:
+        problems.append({"field": cut_field, "error": f"{cut_field}: response was truncated in this field"})
+    if not problems:
+        return doc
+
+    print(f"⚠️ {doc.get('document_type')} failed validation: {problems}")
+    repaired = {}
+    try:
+        repaired = _repair_fields(doc, problems, image_files)
+        doc.update(repaired)
+    except Exception as e:
+        print(f"⚠️ Warning: Field repair failed: {e}")
+
+    remaining = _validate_document(doc)
+    if cut_field and cut_field not in repaired and cut_field not in {p["field"] for p in remaining}:
+        remaining.append({"field": cut_field, "error": f"{cut_field}: response was truncated in this field and may be incomplete"})
+    if remaining:
+        doc["validation_issues"] = remaining
+    return doc
 
 
 def _get_mime_type(file_path: str) -> str:
@@ -96,16 +342,39 @@ def _read_file(file_path: str) -> bytes:
 
       
 
-def parse_medical_document() -> Dict[str, Any]:
+async def parse_medical_document(tool_context: ToolContext = None) -> Dict[str, Any]:
     """
     Parse medical documents (bill, EOB, or denial letter) using Gemini Vision.
+
+    The parsed documents are also stored in session state under
+    "parsed_documents" for the downstream agents, with the invocation that
+    parsed them under "parsed_documents_invocation".
+    """
+    uploads_dir = UPLOADS_DIR
+    if tool_context is not None:
+        uploads_dir = tool_context.state.get("upload_folder") or UPLOADS_DIR
+
+    # The Gemini call blocks, so keep it off the event loop
+    result = await asyncio.to_thread(_parse_uploaded_documents, uploads_dir)
+
+    if tool_context is not None and "error" not in result:
+        tool_context.state["parsed_documents"] = result.get("documents", [result])
+        tool_context.state["parsed_documents_invocation"] = tool_context.invocation_id
+    return result
+
+
+def _parse_uploaded_documents(uploads_dir: str) -> Dict[str, Any]:
+    """
+    Parse every document in uploads_dir, deleting the files afterwards.
+
+    A per-invocation folder is always removed, even if parsing fails. Files in
+    the shared UPLOADS_DIR are only deleted after a successful parse.
     """
     
     image_files = []  # Track files for cleanup
     
     try:
         # Get all image files from uploads folder
-        uploads_dir = "orchestrator_agent/uploads"
         image_extensions = ('.jpg', '.jpeg', '.png', '.pdf')
         
         if not os.path.exists(uploads_dir):
@@ -168,6 +437,8 @@ If you find only ONE document type (even if multi-page):
 Return a single JSON object:
 {{"document_type": "medical_bill", "hospital_name": "...", ...}}
 
+Each document must also include "source_files": the file names (shown before each image) of the pages it was extracted from.
+
 **CRITICAL RULES:**
 - Use EXACT field names from schemas
 - For dates: use "YYYY-MM-DD" format
@@ -187,6 +458,7 @@ Start your response with either [ or {{ - nothing else.
         for file_path in image_files:
             file_bytes = _read_file(file_path)
             mime_type = _get_mime_type(file_path)
+            parts.append({"text": f"File: {os.path.basename(file_path)}"})
             parts.append({"inline_data": {"mime_type": mime_type, "data": file_bytes}})
         
         # Add text prompt at the end
@@ -201,12 +473,8 @@ Start your response with either [ or {{ - nothing else.
         )
         
         # Parse response - handle different response formats
-        response_text = ""
-        if hasattr(response, 'text'):
-            response_text = response.text
-        elif hasattr(response, 'candidates') and len(response.candidates) > 0:
-            response_text = response.candidates[0].content.parts[0].text
-        else:
+        response_text = _extract_response_text(response)
+        if not response_text:
             return {
                 "error": "Could not extract text from response",
                 "raw_response": str(response)
@@ -216,23 +484,35 @@ Start your response with either [ or {{ - nothing else.
         print(f"📥 First 200 chars: {response_text[:200]}")
         
         # Parse response
+        truncated = False
         try:
-            parsed_data = _parse_json_response(response_text)
-        except json.JSONDecodeError as e:
-            return {
-                "error": "Failed to parse JSON from model response",
-                "details": str(e),
-                "raw_response": response_text[:500]
-            }
+            parsed_data, truncated = _parse_json_response_with_truncation(response_text)
+        except json.JSONDecodeError:
+            try:
+                parsed_data = _repair_json_text(response_text)
+            except json.JSONDecodeError as e:
+                return {
+                    "error": "Failed to parse JSON from model response",
+                    "details": str(e),
+                    "raw_response": response_text[:500]
+                }
         
         # Handle both array and single object responses
         if isinstance(parsed_data, list):
             # Multiple documents
             print(f"✅ Parsed {len(parsed_data)} documents")
             for doc in parsed_data:
+                # A truncated response stopped in the last key of its last document
+                cut_field = next(reversed(doc), None) if truncated and doc is parsed_data[-1] else None
                 doc_type = doc.get('document_type') or doc.get('doc_type')
                 if doc_type:
                     doc['document_type'] = doc_type
+                    _validate_and_repair(doc, image_files, cut_field)
+            if truncated and parsed_data:
+                parsed_data[-1].setdefault("validation_issues", []).append({
+                    "field": "__response__",
+                    "error": "Response was truncated in this document; any documents after it may be missing",
+                })
             
             result = {
                 "documents": parsed_data,
@@ -249,7 +529,9 @@ Start your response with either [ or {{ - nothing else.
                 }
             
             print(f"✅ Parsed single document: {doc_type}")
+            cut_field = next(reversed(parsed_data), None) if truncated else None
             parsed_data['document_type'] = doc_type
+            _validate_and_repair(parsed_data, image_files, cut_field)
             parsed_data['processed_files'] = [os.path.basename(f) for f in image_files]
             result = parsed_data
         
@@ -272,12 +554,16 @@ Start your response with either [ or {{ - nothing else.
             "error": f"Unexpected error during parsing: {e}",
             "details": str(e)
         }
+    finally:
+        # A per-invocation folder is never reused, so remove it even if parsing failed
+        if os.path.abspath(uploads_dir) != os.path.abspath(UPLOADS_DIR):
+            shutil.rmtree(uploads_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
     print("TESTING DOCUMENT PARSER TOOL")
     
-    result = parse_medical_document()
+    result = asyncio.run(parse_medical_document())
     
     if "error" in result:
         print(f" Error: {result['error']}")
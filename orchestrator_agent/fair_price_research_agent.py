@@ -3,7 +3,10 @@ from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.adk.models.google_llm import Gemini
 from google.adk.tools import google_search
+from orchestrator_agent.analysis_cache import attach_analysis_cache
+from orchestrator_agent.price_knowledge_base import attach_price_knowledge_base
 from dotenv import load_dotenv
+from pydantic import BaseModel, Field
 import sys
 import asyncio
 import logging
@@ -21,6 +24,14 @@ model = "gemini-2.5-flash"
 
 session_service = InMemorySessionService()
 
+class ChargeResearchRequest(BaseModel):
+    hospital_name: str | None = Field(None, description="Name of the medical provider")
+    city: str | None = Field(None, description="City of the medical provider")
+    country: str | None = Field(None, description="Country of the medical provider")
+    code: str | None = Field(None, description="CPT/HCPCS or other procedure code of the charge")
+    description: str = Field(..., description="Description of the charged service")
+    billed_amount: float = Field(..., description="Amount billed for this charge")
+
 fair_price_research_agent = LlmAgent(
     name="fair_price_research_agent",
     model=Gemini(model=model),
@@ -28,9 +39,9 @@ fair_price_research_agent = LlmAgent(
     instruction="""
 You are part of an orchestrator that acts as a medical advocate agent. The previous agent would parse medical documents and extract relevant information. 
 
-When given medical charges (procedure codes or descriptions with billed amounts), you:
+You are given ONE charge from a medical bill as JSON (hospital_name, city, country, code, description, billed_amount). The orchestrator calls you once per charge and shows each result to the user as soon as it is ready, so analyze only this charge. For it, you:
 1. Research current fair market prices using Google Search
-2. Compare billed amounts against Medicare rates (when available) and market data
+2. Compare the billed amount against Medicare rates (when available) and market data
 3. Identify overcharges and potential savings
 4. Provide evidence-based assessments with sources
 
@@ -45,9 +56,16 @@ When given medical charges (procedure codes or descriptions with billed amounts)
   * "[procedure] fair price healthcare bluebook"
   * "[procedure] hospital cost transparency"
 
+**KNOWN RATES (from previous research):**
+{known_local_prices?}
+
+- If a known rate is listed above for the charge's code and rate type, use it directly instead of searching for it
+- Only search for codes and rate types that are not listed above
+- Cite the listed source URLs for rates you take from this list
+
 **WORKFLOW:**
 
-For EACH charge:
+For the charge:
 
 1. **Identify what to search for:**
    - If you have CPT code: Search "CPT code [code] average cost 2024"
@@ -90,33 +108,27 @@ For EACH charge:
 **OUTPUT FORMAT:**
 
 {
-"hospital_name": [Name],
-"patient_name": [Name],
-"procedures": [
-    { 
-         "procedure_code": [CPT code or N/A],
-         "procedure_name": [Name],
-         "billed_amount": [Amount],
-         "medicare_rate/govt_rate": [Amount or N/A],
-         "commercial_average": [Amount or N/A],
-         "overcharge_amount": [Amount or N/A],
-         "verdict": [Significantly overpriced / Overpriced / Fair / Good price],
-
-      },
-      "summary" : {
-         "total_billed": [Sum],
-         "total_medicare": [Sum or N/A],
-         "total_commercial": [Sum or N/A],
-         "total_overcharge": [Sum or N/A],
-         "overall_verdict": [Summary verdict]
-      }
-   
+   "procedure_code": [CPT code or N/A],
+   "procedure_name": [Name],
+   "billed_amount": [Amount],
+   "medicare_rate/govt_rate": [Amount or N/A],
+   "medicare_source_url": [URL where the Medicare/govt rate was found or N/A],
+   "commercial_average": [Amount or N/A],
+   "commercial_source_url": [URL where the commercial rate was found or N/A],
+   "overcharge_amount": [Amount or N/A],
+   "verdict": [Significantly overpriced / Overpriced / Fair / Good price]
 }
+
+Return ONLY this JSON object - no markdown, no other text.
 """,
+    input_schema=ChargeResearchRequest,
     tools=[google_search],
     output_key="fair_price_search_results"
 )
 
+attach_analysis_cache(fair_price_research_agent)
+attach_price_knowledge_base(fair_price_research_agent)
+
 # Use same app name to avoid mismatch warning
 runner = Runner(app_name="InMemoryRunner", agent=fair_price_research_agent, session_service=session_service)
 
@@ -3,7 +3,9 @@ from google.adk.sessions import InMemorySessionService
 from google.adk.agents import LlmAgent
 from google.adk.runners import Runner
 from google.adk.models.google_llm import Gemini
+from orchestrator_agent.analysis_cache import attach_analysis_cache
 from dotenv import load_dotenv
+from pydantic import BaseModel, Field
 import sys
 
 
@@ -16,6 +18,15 @@ if sys.platform == 'win32':
 app_name = "insurance_advocate_agent"
 model = "gemini-2.5-flash"
 
+class DenialReviewRequest(BaseModel):
+    insurance_company: str = Field(..., description="Name of the insurance provider")
+    policy_name: str | None = Field(None, description="Policy name or plan, if known")
+    denied_service: str = Field(..., description="The service or item that was denied")
+    denied_amount: str | None = Field(None, description="Amount that was denied, if known")
+    denial_reason: str = Field(..., description="Reason given for denying this service")
+    appeal_deadline: str | None = Field(None, description="Deadline to file an appeal")
+    appeal_instructions: str | None = Field(None, description="Appeal instructions from the letter")
+
 insurance_advocate_agent = LlmAgent(
     name="insurance_advocate_agent",
     model=Gemini(model=model),
@@ -23,9 +34,9 @@ insurance_advocate_agent = LlmAgent(
     instruction="""
 You are part of an orchestrator that acts as a medical advocate agent. 
 
-When given an insurance denial or EOB, you:
+You are given ONE denied service from an insurance denial or EOB as JSON (insurance_company, policy_name, denied_service, denied_amount, denial_reason, appeal_deadline, appeal_instructions). The orchestrator calls you once per denied service and shows each result to the user as soon as it is ready, so analyze only this denial. For it, you:
 1. Research the specific insurance company's policy terms using Google Search
-2. Compare denial reasons against actual policy coverage
+2. Compare the denial reason against actual policy coverage
 3. Determine if denial is justified or appealable
 4. Provide evidence-based appeal strategy with sources
 
@@ -42,7 +53,7 @@ When given an insurance denial or EOB, you:
 
 **WORKFLOW:**
 
-For EACH denial reason:
+For the denial:
 
 1. **Identify what to search for:**
    - Extract insurance company name (e.g., "HDFC ERGO")
@@ -56,7 +67,7 @@ For EACH denial reason:
      * "Star Health Comprehensive Plan claim requirements"
      * "ICICI Lombard claim documentation needed"
 
-3. **Search for each denied item:**
+3. **Search for the denied item:**
    - If denied for room rent → search policy's room rent limits
    - If denied for missing docs → search policy's claim requirements
    - If denied for procedure → search policy's coverage for that procedure
@@ -89,16 +100,11 @@ For EACH denial reason:
 {
   "insurance_company": [Name],
   "policy_name": [Policy],
-  "policy_number": [Number if available],
-  "denial_analysis": [
-    {
-      "denied_item": [Service/Item name],
-      "denied_amount": [Amount],
-      "denial_reason": [Reason given],
-      "policy_terms_found": [What you found from search],
-      "verdict": [Justified / Unjustified / Needs clarification]
-    }
-  ],
+  "denied_item": [Service/Item name],
+  "denied_amount": [Amount],
+  "denial_reason": [Reason given],
+  "policy_terms_found": [What you found from search],
+  "verdict": [Justified / Unjustified / Needs clarification],
   "appeal_strategy": {
     "is_appeal_recommended": [true/false],
     "appeal_deadline": [Date if found],
@@ -110,15 +116,20 @@ For EACH denial reason:
   "next_steps": [Actionable list]
 }
 
+Return ONLY this JSON object - no markdown, no other text.
+
 **CRITICAL:**
 - You MUST call google_search multiple times (at least 3-5 searches)
-- Search for EACH denied item separately
 - Don't make assumptions - find actual policy documents
 - Provide source links for everything you claim
 """,
-    tools=[google_search]
+    input_schema=DenialReviewRequest,
+    tools=[google_search],
+    output_key="insurance_analysis_results"
 )
 
+attach_analysis_cache(insurance_advocate_agent)
+
 runner = Runner(
     app_name=app_name, 
     agent=insurance_advocate_agent, 
@@ -0,0 +1,190 @@
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from orchestrator_agent.document_parser_agent import _parse_json_response
+from orchestrator_agent.fair_price_research_agent import ChargeResearchRequest
+from orchestrator_agent.insurance_advocate_agent import DenialReviewRequest
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, AsyncGenerator, Optional
+import google.genai.types as types
+import asyncio
+import json
+import os
+
+# Per-line agent runs in flight at once, per session. Each run is a model call
+# plus its searches, so the total across the service is this times
+# MEDIBILL_MAX_CONCURRENT_JOBS.
+MAX_CONCURRENT_LINES = int(os.getenv("MEDIBILL_MAX_CONCURRENT_LINES", "5"))
+
+
+def _document_type(document: dict) -> Optional[str]:
+    return document.get("document_type") or document.get("doc_type")
+
+
+def _line_request(schema: type[BaseModel], **fields) -> Optional[BaseModel]:
+    try:
+        return schema(**fields)
+    except ValidationError as e:
+        print(f"⚠️ Warning: Skipping line item {fields}: {e.error_count()} invalid field(s)")
+        return None
+
+
+def charge_requests(documents: list[dict]) -> list[ChargeResearchRequest]:
+    """One fair price research request per charge on each medical bill"""
+    requests = []
+    for bill in documents:
+        if _document_type(bill) != "medical_bill":
+            continue
+        for charge in bill.get("charges") or []:
+            if not isinstance(charge, dict):
+                continue
+            requests.append(_line_request(
+                ChargeResearchRequest,
+                hospital_name=bill.get("hospital_name"),
+                city=bill.get("city"),
+                country=bill.get("country"),
+                code=charge.get("code"),
+                description=charge.get("description"),
+                billed_amount=charge.get("amount"),
+            ))
+    return [r for r in requests if r is not None]
+
+
+def _denied_amount(service: str, coverage_rows: list[dict]) -> Optional[str]:
+    """Billed amount of the EOB line for this service, if insurance paid nothing on it"""
+    service = service.lower()
+    for row in coverage_rows:
+        row_service = str(row.get("service") or "").lower()
+        if row_service and (row_service in service or service in row_service) and not row.get("paid_by_insurance"):
+            return str(row.get("billed_amount")) if row.get("billed_amount") is not None else None
+    return None
+
+
+def denial_requests(documents: list[dict]) -> list[DenialReviewRequest]:
+    """
+    One insurance advocate request per denied service.
+
+    Denied services come from denial letters. Without a letter, EOB lines the
+    insurer paid nothing on are treated as denials with no stated reason.
+    """
+    eobs = [d for d in documents if _document_type(d) == "insurance_eob"]
+    letters = [d for d in documents if _document_type(d) == "denial_letter"]
+    coverage_rows = [row for eob in eobs for row in eob.get("coverage_details") or [] if isinstance(row, dict)]
+
+    requests = []
+    for letter in letters:
+        reasons = [str(r) for r in letter.get("denial_reasons") or []]
+        for i, service in enumerate(letter.get("denied_services") or []):
+            requests.append(_line_request(
+                DenialReviewRequest,
+                insurance_company=letter.get("insurance_company") or "Unknown",
+                denied_service=str(service),
+                denied_amount=_denied_amount(str(service), coverage_rows),
+                # Letters usually list reasons in the same order as services
+                denial_reason=reasons[i] if i < len(reasons) else "; ".join(reasons) or "Not stated in the letter",
+                appeal_deadline=letter.get("appeal_deadline"),
+                appeal_instructions=letter.get("appeal_instructions"),
+            ))
+
+    if not letters:
+        for eob in eobs:
+            for row in eob.get("coverage_details") or []:
+                if isinstance(row, dict) and row.get("service") and row.get("billed_amount") and not row.get("paid_by_insurance"):
+                    requests.append(_line_request(
+                        DenialReviewRequest,
+                        insurance_company=eob.get("insurance_company") or "Unknown",
+                        denied_service=str(row["service"]),
+                        denied_amount=str(row["billed_amount"]),
+                        denial_reason="Not stated on the EOB",
+                    ))
+    return [r for r in requests if r is not None]
+
+
+class LineItemAnalysisAgent(BaseAgent):
+    """
+    Analyzes every charge and denied service from the documents parsed in this
+    invocation, running up to max_concurrency per-line agents at once.
+
+    A partial event is yielded as each line finishes, with the structured result
+    ({"line_type", "input", "analysis"}) in custom_metadata["partial_result"].
+    The collected results are then stored in state under "charge_results" and
+    "denial_results" for the summary.
+    """
+
+    charge_agent: BaseAgent = Field(..., description="Agent run once per charge")
+    denial_agent: BaseAgent = Field(..., description="Agent run once per denied service")
+    max_concurrency: int = Field(MAX_CONCURRENT_LINES, description="Per-line runs in flight at once")
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        # Follow-up messages without new documents reuse the earlier results
+        if state.get("parsed_documents_invocation") != ctx.invocation_id:
+            return
+
+        documents = state.get("parsed_documents") or []
+        lines = [("charge", self.charge_agent, r) for r in charge_requests(documents)]
+        lines += [("denial", self.denial_agent, r) for r in denial_requests(documents)]
+        if not lines:
+            return
+
+        print(f"🔀 Analyzing {len(lines)} line item(s), {min(len(lines), self.max_concurrency)} at a time")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def analyze(index: int, line_type: str, agent: BaseAgent, request: BaseModel) -> tuple[int, dict]:
+            async with semaphore:
+                analysis = await self._run_line(ctx, agent, request)
+            return index, {"line_type": line_type, "input": request.model_dump(exclude_none=True), "analysis": analysis}
+
+        tasks = [asyncio.create_task(analyze(i, *line)) for i, line in enumerate(lines)]
+        results: list[Optional[dict]] = [None] * len(lines)
+        try:
+            for finished in asyncio.as_completed(tasks):
+                index, partial = await finished
+                results[index] = partial
+                # Partial and content-less: streamed to the caller, but not a final
+                # response and not saved to history (the summary reads the state)
+                yield Event(
+                    invocation_id=ctx.invocation_id,
+                    author=self.name,
+                    branch=ctx.branch,
+                    partial=True,
+                    custom_metadata={"partial_result": partial},
+                )
+        finally:
+            # Stop the remaining lines if the invocation is cancelled or times out
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta={
+                "charge_results": [r for r in results if r["line_type"] == "charge"],
+                "denial_results": [r for r in results if r["line_type"] == "denial"],
+            }),
+        )
+
+    async def _run_line(self, ctx: InvocationContext, agent: BaseAgent, request: BaseModel) -> Any:
+        """Run agent on one line in its own session, like AgentTool does, and return its parsed output"""
+        runner = Runner(app_name=ctx.app_name, agent=agent, session_service=InMemorySessionService())
+        message = types.Content(role="user", parts=[types.Part(text=request.model_dump_json(exclude_none=True))])
+        text = ""
+        try:
+            session = await runner.session_service.create_session(app_name=ctx.app_name, user_id=ctx.user_id)
+            async for event in runner.run_async(user_id=ctx.user_id, session_id=session.id, new_message=message):
+                if event.content and event.content.parts:
+                    text = "".join(part.text or "" for part in event.content.parts if not part.thought) or text
+        except Exception as e:
+            print(f"❌ Error running {agent.name}: {e}")
+            return {"error": f"Error running {agent.name}: {e}"}
+        finally:
+            await runner.close()
+
+        try:
+            return _parse_json_response(text)
+        except json.JSONDecodeError:
+            return {"raw_analysis": text}
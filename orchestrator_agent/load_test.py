@@ -0,0 +1,417 @@
+"""
+Load test for the full orchestrator pipeline.
+
+Runs N concurrent simulated users through the Runner from agent.py, each
+uploading a synthetic bill, EOB and denial letter. Gemini, Google Search and
+the document parser's Vision call are replaced with mocks that only sleep for
+a configurable latency, so the numbers reflect this process (event loop,
+session/artifact services, upload folder, tool threads), not the model.
+
+Usage (from the repository root):
+    python -m orchestrator_agent.load_test --stages 1,5,10,25 --sessions-per-stage 50
+"""
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_response import LlmResponse
+from orchestrator_agent import agent, document_parser_agent
+from orchestrator_agent.analysis_cache import AnalysisCache, attach_analysis_cache
+from orchestrator_agent.price_knowledge_base import PriceKnowledgeBase, attach_price_knowledge_base
+from typing import AsyncGenerator
+import google.genai.types as types
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+SYNTHETIC_DOCUMENTS = [
+    {
+        "document_type": "medical_bill",
+        "hospital_name": "MidTown Orthopedics",
+        "city": "Springfield",
+        "country": "USA",
+        "patient_name": "Load Test Patient",
+        "patient_id": "LT-0001",
+        "date_of_service": "2025-03-22",
+        "charges": [
+            {"code": "99203", "description": "New patient office visit", "amount": 155.0, "diagnosis_code": "M25.561"},
+            {"code": "73560", "description": "X-ray knee 2 views", "amount": 79.0, "diagnosis_code": "M25.561"},
+            {"code": "L1830", "description": "Knee immobilizer", "amount": 57.0, "diagnosis_code": "M25.561"},
+        ],
+        "total_billed": 291.0,
+        "amount_paid": 138.47,
+        "amount_due": 152.53,
+        "due_date": "2025-04-22",
+        "source_files": ["bill.png"],
+    },
+    {
+        "document_type": "insurance_eob",
+        "insurance_company": "Acme Health",
+        "policy_number": "P-123456",
+        "patient_name": "Load Test Patient",
+        "claim_number": "C-987654",
+        "date_of_service": "2025-03-22",
+        "coverage_details": [
+            {"service": "X-ray knee 2 views", "billed_amount": 79.0, "allowed_amount": 41.0, "paid_by_insurance": 32.8, "patient_responsibility": 8.2},
+        ],
+        "total_patient_responsibility": 8.2,
+        "source_files": ["eob.png"],
+    },
+    {
+        "document_type": "denial_letter",
+        "insurance_company": "Acme Health",
+        "patient_name": "Load Test Patient",
+        "claim_number": "C-987654",
+        "policy_number": "P-123456",
+        "date_of_service": "2025-03-22",
+        "denied_services": ["Knee immobilizer"],
+        "denial_reasons": ["Durable medical equipment requires prior authorization"],
+        "denial_date": "2025-04-01",
+        "appeal_deadline": "2025-05-01",
+        "appeal_instructions": "Mail a written appeal to the address on your policy card.",
+        "source_files": ["denial.png"],
+    },
+]
+
+MOCK_ANALYSIS = {
+    "fair_price_research_agent": json.dumps({
+        "procedure_code": "99203",
+        "procedure_name": "New patient office visit",
+        "billed_amount": 155.0,
+        "medicare_rate/govt_rate": 110.5,
+        "commercial_average": 150.0,
+        "overcharge_amount": "N/A",
+        "verdict": "Fair",
+    }),
+    "insurance_advocate_agent": json.dumps({
+        "insurance_company": "Acme Health",
+        "denied_item": "Knee immobilizer",
+        "denial_reason": "Prior authorization",
+        "policy_terms_found": "N/A",
+        "verdict": "Needs clarification",
+        "appeal_strategy": {"is_appeal_recommended": True},
+        "next_steps": ["File an appeal"],
+    }),
+}
+
+
+def _latency(mean_seconds: float) -> float:
+    """Lognormal-ish jitter around the mean, like real API latencies"""
+    if mean_seconds <= 0:
+        return 0.0
+    return random.lognormvariate(0, 0.35) * mean_seconds
+
+
+def synthetic_png(width: int, height: int, seed: int) -> bytes:
+    """Grayscale PNG of noise, roughly the size of a scanned page at the same resolution"""
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(width) for _ in range(height))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+class MockOrchestratorLlm(BaseLlm):
+    """
+    Stands in for the intake and summary agents' model: saves and parses the
+    upload, then answers with text. The per-line agents run in between.
+    """
+
+    latency: float = 0.5
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(_latency(self.latency))
+        responses = sum(
+            1
+            for content in llm_request.contents
+            for part in (content.parts or [])
+            if part.function_response
+        )
+        plan = [("process_user_file", {}), ("parse_medical_document", {})]
+
+        if responses < len(plan) and plan[responses][0] in llm_request.tools_dict:
+            name, args = plan[responses]
+            part = types.Part(function_call=types.FunctionCall(name=name, args=args))
+        else:
+            part = types.Part(text="**Medical Bill Price Analysis**\n...\n**Insurance Denial & Appeal Analysis**\n...")
+        yield LlmResponse(content=types.Content(role="model", parts=[part]))
+
+
+class MockResearchLlm(BaseLlm):
+    """Stands in for a research agent's model, including the time spent on Google searches"""
+
+    latency: float = 1.0
+    search_latency: float = 0.8
+    searches: int = 3
+    agent_name: str = ""
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(_latency(self.latency) + sum(_latency(self.search_latency) for _ in range(self.searches)))
+        text = MOCK_ANALYSIS.get(self.agent_name, "{}")
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+
+
+class MockGenaiClient:
+    """Stands in for the genai.Client used by the document parser. Blocks like the real one."""
+
+    def __init__(self, latency: float):
+        self.models = self
+        self.latency = latency
+
+    def generate_content(self, model, contents):
+        time.sleep(_latency(self.latency))
+
+        class Response:
+            text = json.dumps(SYNTHETIC_DOCUMENTS)
+        return Response()
+
+
+def install_mocks(args: argparse.Namespace) -> str | None:
+    """
+    Swap every model call in the pipeline for a mock.
+
+    With --keep-caches, the analysis cache and price knowledge base are
+    re-attached on a temporary directory, which is returned so it can be
+    removed. Mock output never reaches the configured stores.
+    """
+    cache_dir = tempfile.mkdtemp(prefix="medibill-load-test-") if args.keep_caches else None
+    for llm_agent in (agent.intake_agent, agent.summary_agent):
+        llm_agent.model = MockOrchestratorLlm(model="mock-orchestrator", latency=args.model_latency)
+    for research_agent in (agent.fair_price_research_agent, agent.insurance_advocate_agent):
+        research_agent.model = MockResearchLlm(
+            model="mock-research",
+            latency=args.model_latency,
+            search_latency=args.search_latency,
+            searches=args.searches,
+            agent_name=research_agent.name,
+        )
+        # google_search runs inside Gemini, so it's simulated by the mock's search latency
+        research_agent.tools = []
+        # Every simulated user sends the same documents, so caches would hit every time
+        research_agent.before_agent_callback = None
+        research_agent.after_agent_callback = None
+        if cache_dir:
+            # Attached after the model swap so the cache version matches the mock
+            attach_analysis_cache(research_agent, AnalysisCache(path=os.path.join(cache_dir, "analysis_cache.sqlite")))
+    if cache_dir:
+        attach_price_knowledge_base(
+            agent.fair_price_research_agent,
+            PriceKnowledgeBase(path=os.path.join(cache_dir, "price_knowledge_base.sqlite")),
+        )
+    document_parser_agent.client = MockGenaiClient(args.parse_latency)
+    return cache_dir
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from short sleeps"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self) -> None:
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> list[float]:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return self.samples
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+async def run_session(images: dict[str, bytes], user_index: int) -> dict:
+    """One simulated user uploading a packet and waiting for the final summary"""
+    user_id = f"load-user-{user_index}"
+    session = await agent.session_service.create_session(app_name=agent.runner.app_name, user_id=user_id)
+
+    # Copy the bytes so each session holds its own upload, as real requests would
+    parts = [
+        types.Part(inline_data=types.Blob(mime_type="image/png", data=bytes(bytearray(data)), display_name=name))
+        for name, data in images.items()
+    ]
+    parts.append(types.Part(text="I've uploaded my bill, EOB and denial letter. Am I being overcharged?"))
+
+    start = time.perf_counter()
+    first_event = None
+    first_result = None
+    final = False
+    error = None
+    try:
+        async for event in agent.runner.run_async(
+            user_id=user_id, session_id=session.id, new_message=types.Content(role="user", parts=parts)
+        ):
+            if first_event is None:
+                first_event = time.perf_counter() - start
+            if first_result is None and agent.partial_results(event):
+                first_result = time.perf_counter() - start
+            if event.author == agent.summary_agent.name and event.is_final_response() \
+                    and event.content and event.content.parts and event.content.parts[0].text:
+                final = True
+        if not final:
+            error = "No final response"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        "latency": time.perf_counter() - start,
+        "first_event": first_event or 0.0,
+        "first_result": first_result,
+        "error": error,
+    }
+
+
+async def run_stage(concurrency: int, sessions: int, images: dict[str, bytes], counter: list[int]) -> dict:
+    """Run `sessions` sessions with `concurrency` users working through them back to back"""
+    results = []
+    remaining = [sessions]
+
+    async def user() -> None:
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            counter[0] += 1
+            results.append(await run_session(images, counter[0]))
+
+    gc.collect()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    monitor = LoopLagMonitor()
+    monitor.start()
+    start = time.perf_counter()
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+
+    elapsed = time.perf_counter() - start
+    lag = await monitor.stop()
+    gc.collect()
+    memory_after = tracemalloc.get_traced_memory()[0]
+
+    latencies = [r["latency"] for r in results if not r["error"]]
+    errors = [r["error"] for r in results if r["error"]]
+    return {
+        "concurrency": concurrency,
+        "sessions": len(results),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_p50_s": _percentile(latencies, 50),
+        "latency_p95_s": _percentile(latencies, 95),
+        "latency_p99_s": _percentile(latencies, 99),
+        "first_event_p95_s": _percentile([r["first_event"] for r in results], 95),
+        "first_result_p95_s": _percentile([r["first_result"] for r in results if r["first_result"] is not None], 95),
+        "loop_lag_p99_ms": _percentile(lag, 99) * 1000,
+        "loop_lag_max_ms": max(lag, default=0.0) * 1000,
+        "memory_growth_per_session_kb": (memory_after - memory_before) / 1024 / max(len(results), 1),
+    }
+
+
+def print_report(stages: list[dict]) -> None:
+    header = f"{'users':>6} {'sessions':>8} {'errors':>6} {'sess/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'1st res':>7} {'lag p99 ms':>10} {'lag max ms':>10} {'KB/session':>10}"
+    print(header)
+    print("-" * len(header))
+    for s in stages:
+        print(
+            f"{s['concurrency']:>6} {s['sessions']:>8} {s['errors']:>6} {s['throughput_per_s']:>7.2f} "
+            f"{s['latency_p50_s']:>7.2f} {s['latency_p95_s']:>7.2f} {s['latency_p99_s']:>7.2f} {s['first_result_p95_s']:>7.2f} "
+            f"{s['loop_lag_p99_ms']:>10.1f} {s['loop_lag_max_ms']:>10.1f} {s['memory_growth_per_session_kb']:>10.1f}"
+        )
+    for s in stages:
+        if s["first_error"]:
+            print(f"❌ {s['concurrency']} users, first error: {s['first_error']}")
+
+
+async def main(args: argparse.Namespace) -> list[dict]:
+    cache_dir = install_mocks(args)
+    try:
+        return await _run_stages(args)
+    finally:
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+async def _run_stages(args: argparse.Namespace) -> list[dict]:
+    images = {
+        name: synthetic_png(args.image_width, args.image_height, seed)
+        for seed, name in enumerate(["bill.png", "eob.png", "denial.png"])
+    }
+    print(f"📄 Synthetic packet: {sum(len(d) for d in images.values()) / 1024:.0f} KB across {len(images)} images")
+
+    # One unmeasured session first, so imports, client setup and first-call
+    # caches aren't counted as stage 1 latency, loop lag and memory growth
+    print("🔥 Warming up with one unmeasured session...")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        warmup = await run_session(images, 0)
+    if warmup["error"]:
+        print(f"⚠️ Warning: Warm-up session failed: {warmup['error']}")
+
+    tracemalloc.start()
+    counter = [0]
+    stages = []
+    for concurrency in args.stages:
+        print(f"🚀 Running {args.sessions_per_stage} sessions with {concurrency} concurrent users...")
+        # The pipeline prints progress for every file and call; hide it unless asked
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            stages.append(await run_stage(concurrency, args.sessions_per_stage, images, counter))
+    tracemalloc.stop()
+    return stages
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Concurrency load test for the MediBill orchestrator Runner")
+    parser.add_argument("--stages", type=lambda v: [int(x) for x in v.split(",")], default=[1, 5, 10, 25],
+                        help="Comma-separated concurrent user counts to ramp through")
+    parser.add_argument("--sessions-per-stage", type=int, default=25, help="Sessions to complete at each stage")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="Mean seconds per mocked model call")
+    parser.add_argument("--search-latency", type=float, default=0.8, help="Mean seconds per mocked Google search")
+    parser.add_argument("--searches", type=int, default=3, help="Mocked searches per research agent run")
+    parser.add_argument("--parse-latency", type=float, default=2.0, help="Mean seconds for the mocked Vision parse call")
+    parser.add_argument("--image-width", type=int, default=850, help="Synthetic page width in pixels")
+    parser.add_argument("--image-height", type=int, default=1100, help="Synthetic page height in pixels")
+    parser.add_argument("--keep-caches", action="store_true",
+                        help="Keep the analysis cache and price knowledge base, on a temporary directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own progress output")
+    parser.add_argument("--json", dest="json_path", help="Also write the report as JSON to this path")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # agent.py turns on DEBUG logging for everything, and the mocks have no token usage to report
+    logging.getLogger().setLevel(logging.ERROR)
+
+    stages = asyncio.run(main(args))
+    print_report(stages)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(stages, f, indent=2)
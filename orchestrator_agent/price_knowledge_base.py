@@ -0,0 +1,288 @@
+import datetime
+import json
+import os
+import re
+import sqlite3
+import statistics
+import time
+from typing import Any, Optional
+
+from google.adk.agents import LlmAgent
+from google.adk.agents.callback_context import CallbackContext
+from pydantic import BaseModel, Field
+
+from orchestrator_agent.analysis_cache import chain_callback, structured_request
+from orchestrator_agent.document_parser_agent import _parse_json_response
+
+KB_PATH = os.getenv("MEDIBILL_PRICE_KB_PATH", "orchestrator_agent/cache/price_knowledge_base.sqlite")
+KB_ENABLED = os.getenv("MEDIBILL_PRICE_KB", "1") != "0"
+
+# Freshness halves every FRESHNESS_HALF_LIFE_DAYS
+FRESHNESS_HALF_LIFE_DAYS = float(os.getenv("MEDIBILL_PRICE_KB_HALF_LIFE_DAYS", "180"))
+# Rates scoring below this (confidence x freshness) are not offered to the agent
+MIN_SCORE = float(os.getenv("MEDIBILL_PRICE_KB_MIN_SCORE", "0.35"))
+
+# Keys in the fair price agent's per-procedure output, by rate type
+RATE_FIELDS = {
+    "medicare": ("medicare_rate/govt_rate", "medicare_source_url"),
+    "commercial": ("commercial_average", "commercial_source_url"),
+}
+
+
+class PriceObservation(BaseModel):
+    code: str = Field(..., description="CPT/HCPCS or other procedure code")
+    city: str | None = Field(None, description="City the rate applies to")
+    country: str | None = Field(None, description="Country the rate applies to")
+    rate_type: str = Field(..., description="medicare or commercial")
+    value: float = Field(..., description="Rate in the bill's currency")
+    source_url: str | None = Field(None, description="Where the rate was found")
+    observed_date: str = Field(..., description="Date the rate was found (YYYY-MM-DD)")
+
+
+class KnownRate(BaseModel):
+    code: str = Field(..., description="Procedure code")
+    rate_type: str = Field(..., description="medicare or commercial")
+    value: float = Field(..., description="Median of matching observations")
+    locality: str = Field(..., description="Region the observations came from")
+    observations: int = Field(..., description="Number of observations used")
+    source_urls: list[str] = Field(default_factory=list, description="Sources of the observations")
+    last_observed: str = Field(..., description="Most recent observation date")
+    confidence: float = Field(..., description="0-1, from locality match, corroboration, agreement and sourcing")
+    freshness: float = Field(..., description="0-1, decays with age of the newest observation")
+
+
+def _normalize(value: Optional[str]) -> str:
+    return " ".join((value or "").lower().split())
+
+
+def _to_float(value: Any) -> Optional[float]:
+    """Turn '$1,234.50', 1234.5 or 'N/A' into a float or None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    if isinstance(value, str):
+        match = re.search(r"\d[\d,]*(?:\.\d+)?", value)
+        if match:
+            number = float(match.group().replace(",", ""))
+            return number if number > 0 else None
+    return None
+
+
+class PriceKnowledgeBase:
+    """Local store of rates found by past fair price research, indexed by code and region"""
+
+    def __init__(self, path: str = KB_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS price_observations (
+                    code TEXT NOT NULL,
+                    city TEXT NOT NULL,
+                    country TEXT NOT NULL,
+                    rate_type TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    source_url TEXT,
+                    observed_date TEXT NOT NULL,
+                    recorded_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_price_code_region ON price_observations (code, country, city)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    def add(self, observations: list[PriceObservation]) -> int:
+        """
+        Record observations and return how many were stored or updated.
+
+        A source already recorded for the same code, region and rate type is not
+        new evidence: with the same value it is skipped, keeping the original
+        observed_date, and with a new value (e.g. a fee schedule's yearly update)
+        that row's value and date are replaced. Unsourced observations are
+        always stored.
+        """
+        changed = 0
+        with self._connect() as conn:
+            for o in observations:
+                key = (o.code.strip().upper(), _normalize(o.city), _normalize(o.country), o.rate_type)
+                if o.source_url:
+                    existing = conn.execute(
+                        """SELECT rowid, value FROM price_observations
+                        WHERE code = ? AND city = ? AND country = ? AND rate_type = ? AND source_url = ?""",
+                        key + (o.source_url,),
+                    ).fetchone()
+                    if existing:
+                        rowid, value = existing
+                        if round(value, 2) == round(o.value, 2):
+                            continue
+                        conn.execute(
+                            "UPDATE price_observations SET value = ?, observed_date = ?, recorded_at = ? WHERE rowid = ?",
+                            (o.value, o.observed_date, time.time(), rowid),
+                        )
+                        changed += 1
+                        continue
+                conn.execute(
+                    "INSERT INTO price_observations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    key + (o.value, o.source_url, o.observed_date, time.time()),
+                )
+                changed += 1
+        return changed
+
+    def lookup(self, code: str, city: Optional[str], country: Optional[str]) -> list[KnownRate]:
+        """
+        Best known rate per rate type for a code.
+
+        Observations from the same city are preferred, then the same country.
+        """
+        code = code.strip().upper()
+        city, country = _normalize(city), _normalize(country)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT rate_type, city, value, source_url, observed_date FROM price_observations WHERE code = ? AND country = ?",
+                (code, country),
+            ).fetchall()
+
+        rates = []
+        for rate_type in RATE_FIELDS:
+            matching = [r for r in rows if r[0] == rate_type]
+            local = [r for r in matching if city and r[1] == city]
+            if local:
+                rates.append(self._summarize(code, rate_type, local, f"{city}, {country}", locality_weight=0.45))
+            elif matching:
+                rates.append(self._summarize(code, rate_type, matching, country, locality_weight=0.3))
+        return rates
+
+    @staticmethod
+    def _summarize(code: str, rate_type: str, rows: list[tuple], locality: str, locality_weight: float) -> KnownRate:
+        values = [r[2] for r in rows]
+        sources = sorted({r[3] for r in rows if r[3]})
+        last_observed = max(r[4] for r in rows)
+        median = statistics.median(values)
+
+        # Corroboration and sourcing raise confidence, disagreement between observations lowers it
+        spread = statistics.pstdev(values) / median if len(values) > 1 and median else 0.0
+        confidence = (
+            locality_weight
+            + 0.1 * min(len(values) - 1, 3)
+            + (0.15 if sources else 0.0)
+            - min(spread, 0.5)
+        )
+
+        try:
+            age_days = (datetime.date.today() - datetime.date.fromisoformat(last_observed)).days
+        except ValueError:
+            age_days = FRESHNESS_HALF_LIFE_DAYS * 4
+        freshness = 0.5 ** (max(age_days, 0) / FRESHNESS_HALF_LIFE_DAYS)
+
+        return KnownRate(
+            code=code,
+            rate_type=rate_type,
+            value=round(median, 2),
+            locality=locality,
+            observations=len(values),
+            source_urls=sources[:3],
+            last_observed=last_observed,
+            confidence=round(max(0.0, min(confidence, 1.0)), 2),
+            freshness=round(freshness, 2),
+        )
+
+
+def extract_observations(analysis: str, charge: dict) -> list[PriceObservation]:
+    """Pull the rates out of a fair_price_research_agent result for one charge"""
+    try:
+        parsed = _parse_json_response(analysis)
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(parsed, dict):
+        return []
+
+    today = datetime.date.today().isoformat()
+    observations = []
+    for procedure in parsed.get("procedures") or [parsed]:
+        if not isinstance(procedure, dict):
+            continue
+        code = str(procedure.get("procedure_code") or charge.get("code") or "").strip()
+        if not code or code.upper() == "N/A":
+            continue
+        for rate_type, (value_key, source_key) in RATE_FIELDS.items():
+            value = _to_float(procedure.get(value_key))
+            if value is None:
+                continue
+            source_url = procedure.get(source_key)
+            observations.append(PriceObservation(
+                code=code,
+                city=charge.get("city"),
+                country=charge.get("country"),
+                rate_type=rate_type,
+                value=value,
+                source_url=source_url if isinstance(source_url, str) and source_url.startswith("http") else None,
+                observed_date=today,
+            ))
+    return observations
+
+
+def _format_known_rates(rates: list[KnownRate]) -> str:
+    if not rates:
+        return "None - search for this charge."
+    return json.dumps([r.model_dump() for r in rates], indent=2)
+
+
+def attach_price_knowledge_base(agent: LlmAgent, knowledge_base: Optional[PriceKnowledgeBase] = None) -> LlmAgent:
+    """
+    Feed previously found rates to the agent and record the rates it finds.
+
+    Before each run, known rates for the charge's code are put in state under
+    "known_local_prices" for the agent's instruction. After each run, the rates
+    in agent.output_key are added to the knowledge base, except the ones that
+    were served from it, so the store never corroborates itself.
+    """
+    if not KB_ENABLED:
+        return agent
+
+    knowledge_base = knowledge_base or PriceKnowledgeBase()
+
+    def before_agent_callback(callback_context: CallbackContext) -> None:
+        charge = structured_request(callback_context)
+        rates = []
+        if charge is not None and charge.get("code"):
+            try:
+                rates = knowledge_base.lookup(str(charge["code"]), charge.get("city"), charge.get("country"))
+            except sqlite3.Error as e:
+                print(f"⚠️ Warning: Price knowledge base lookup failed: {e}")
+        usable = [r for r in rates if r.confidence * r.freshness >= MIN_SCORE]
+        if usable:
+            print(f"📚 {len(usable)} known rate(s) served from the price knowledge base")
+        callback_context.state["known_local_prices"] = _format_known_rates(usable)
+        callback_context.state["known_local_prices_served"] = [
+            {"rate_type": r.rate_type, "value": r.value} for r in usable
+        ]
+        return None
+
+    def after_agent_callback(callback_context: CallbackContext) -> None:
+        charge = structured_request(callback_context)
+        analysis = callback_context.state.get(agent.output_key)
+        if charge is None or not isinstance(analysis, str):
+            return None
+        served = {
+            (r["rate_type"], round(r["value"], 2))
+            for r in callback_context.state.get("known_local_prices_served") or []
+        }
+        observations = [
+            o for o in extract_observations(analysis, charge)
+            if (o.rate_type, round(o.value, 2)) not in served
+        ]
+        if observations:
+            try:
+                knowledge_base.add(observations)
+            except sqlite3.Error as e:
+                print(f"⚠️ Warning: Could not record rates in price knowledge base: {e}")
+        return None
+
+    chain_callback(agent, "before_agent_callback", before_agent_callback)
+    chain_callback(agent, "after_agent_callback", after_agent_callback)
+    return agent
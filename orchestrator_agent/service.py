@@ -0,0 +1,327 @@
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from orchestrator_agent.agent import runner, partial_results
+from orchestrator_agent.document_parser_agent import _get_mime_type
+from pydantic import BaseModel, Field
+from typing import Any, AsyncIterator, Optional
+from enum import Enum
+import google.genai.types as types
+import asyncio
+import json
+import os
+import time
+import uuid
+
+
+def _positive_int(name: str, default: str) -> int:
+    """Read an integer setting that must be at least 1"""
+    value = int(os.getenv(name, default))
+    if value < 1:
+        raise ValueError(f"{name} must be at least 1, got {value}")
+    return value
+
+
+MAX_CONCURRENT_JOBS = _positive_int("MEDIBILL_MAX_CONCURRENT_JOBS", "4")
+# asyncio.Queue treats 0 as unbounded, which would turn off the 429 backpressure
+MAX_QUEUE_DEPTH = _positive_int("MEDIBILL_MAX_QUEUE_DEPTH", "20")
+# Uploads are read into memory, so cap each request's total size
+MAX_UPLOAD_BYTES = _positive_int("MEDIBILL_MAX_UPLOAD_MB", "25") * 1024 * 1024
+JOB_TIMEOUT_SECONDS = float(os.getenv("MEDIBILL_JOB_TIMEOUT_SECONDS", "300"))
+JOB_RETENTION_SECONDS = float(os.getenv("MEDIBILL_JOB_RETENTION_SECONDS", "3600"))
+
+DEFAULT_MESSAGE = "I've uploaded my medical documents. Can you check if I'm being overcharged and whether any denials can be appealed?"
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+    timed_out = "timed_out"
+
+
+class JobResult(BaseModel):
+    summary: str | None = Field(None, description="Final summary written by the orchestrator")
+    parsed_documents: list[dict] = Field(default_factory=list, description="Documents extracted by the parser")
+    charge_results: list[dict] = Field(default_factory=list, description="Per-charge results from fair_price_research_agent")
+    denial_results: list[dict] = Field(default_factory=list, description="Per-denial results from insurance_advocate_agent")
+
+
+class JobResponse(BaseModel):
+    job_id: str = Field(..., description="Job identifier")
+    status: JobStatus = Field(..., description="Current job status")
+    queue_position: int | None = Field(None, description="Jobs ahead of this one, while queued")
+    created_at: float = Field(..., description="Submission time (epoch seconds)")
+    started_at: float | None = Field(None, description="Time the job started running")
+    finished_at: float | None = Field(None, description="Time the job finished")
+    result: JobResult | None = Field(None, description="Structured outputs, once succeeded")
+    error: str | None = Field(None, description="Error message, if failed or timed out")
+
+
+class Job:
+    """A submitted packet and its progress. Events are kept for streaming."""
+
+    def __init__(self, message: types.Content):
+        self.id = uuid.uuid4().hex
+        self.message = message
+        self.status = JobStatus.queued
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[JobResult] = None
+        self.error: Optional[str] = None
+        self.events: list[dict] = []
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status not in (JobStatus.queued, JobStatus.running)
+
+    async def publish(self, event: dict) -> None:
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def stream(self) -> AsyncIterator[dict]:
+        """Yield every event for this job, waiting for new ones until it finishes"""
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self.events) or self.done)
+                pending = self.events[index:]
+                finished = self.done
+            for event in pending:
+                yield event
+            index += len(pending)
+            if finished and index >= len(self.events):
+                return
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    In-process job queue drained by a fixed pool of async workers.
+
+    Submissions beyond max_queue_depth waiting jobs are rejected with
+    QueueFullError, and each job is cancelled after timeout_seconds.
+    """
+
+    def __init__(self, runner, concurrency: int = MAX_CONCURRENT_JOBS, max_queue_depth: int = MAX_QUEUE_DEPTH,
+                 timeout_seconds: float = JOB_TIMEOUT_SECONDS, retention_seconds: float = JOB_RETENTION_SECONDS):
+        if concurrency < 1 or max_queue_depth < 1:
+            raise ValueError("concurrency and max_queue_depth must be at least 1")
+        self.runner = runner
+        self.concurrency = concurrency
+        self.timeout_seconds = timeout_seconds
+        self.retention_seconds = retention_seconds
+        self.jobs: dict[str, Job] = {}
+        self._queue: asyncio.Queue[Job] = asyncio.Queue(maxsize=max_queue_depth)
+        self._waiting: list[str] = []
+        self._workers: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, message: types.Content) -> Job:
+        self._prune()
+        job = Job(message)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Queue is full ({self.max_queue_depth} jobs waiting)")
+        self.jobs[job.id] = job
+        self._waiting.append(job.id)
+        return job
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def max_queue_depth(self) -> int:
+        return self._queue.maxsize
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        if job.status != JobStatus.queued:
+            return None
+        return self._waiting.index(job.id)
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than the retention period"""
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j.id for j in self.jobs.values() if j.done and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._waiting.remove(job.id)
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status = JobStatus.running
+        job.started_at = time.time()
+        await job.publish({"type": "status", "status": job.status.value})
+
+        try:
+            job.result = await asyncio.wait_for(self._run_agent(job), timeout=self.timeout_seconds)
+            job.status = JobStatus.succeeded
+        except asyncio.TimeoutError:
+            job.status = JobStatus.timed_out
+            job.error = f"Job exceeded {self.timeout_seconds:.0f}s timeout"
+        except Exception as e:
+            job.status = JobStatus.failed
+            job.error = f"Error running job: {e}"
+
+        job.finished_at = time.time()
+        await job.publish({
+            "type": "status",
+            "status": job.status.value,
+            "error": job.error,
+            "result": job.result.model_dump() if job.result else None,
+        })
+
+    async def _run_agent(self, job: Job) -> JobResult:
+        session = await self.runner.session_service.create_session(app_name=self.runner.app_name, user_id=job.id)
+
+        summary = None
+        line_results = []
+        try:
+            async for event in self.runner.run_async(user_id=job.id, session_id=session.id, new_message=job.message):
+                for partial in partial_results(event):
+                    line_results.append(partial)
+                    await job.publish({"type": "partial_result", **partial})
+                for part in (event.content.parts if event.content and event.content.parts else []):
+                    if part.function_call:
+                        await job.publish({"type": "tool_call", "author": event.author, "name": part.function_call.name})
+                    elif part.function_response:
+                        await job.publish({"type": "tool_result", "author": event.author, "name": part.function_response.name})
+                if event.is_final_response() and event.content and event.content.parts:
+                    summary = "".join(part.text or "" for part in event.content.parts) or summary
+
+            session = await self.runner.session_service.get_session(app_name=self.runner.app_name, user_id=job.id, session_id=session.id)
+            state = session.state
+        finally:
+            # Results live on the job; the session and uploaded files would otherwise stay in memory
+            await self._delete_session(job.id, session.id)
+
+        return JobResult(
+            summary=summary,
+            parsed_documents=state.get("parsed_documents") or [],
+            # State keeps the results in document order; the stream has them in finishing order
+            charge_results=state.get("charge_results") or [r for r in line_results if r["line_type"] == "charge"],
+            denial_results=state.get("denial_results") or [r for r in line_results if r["line_type"] == "denial"],
+        )
+
+    async def _delete_session(self, user_id: str, session_id: str) -> None:
+        app_name = self.runner.app_name
+        try:
+            artifact_service = self.runner.artifact_service
+            if artifact_service is not None:
+                for filename in await artifact_service.list_artifact_keys(app_name=app_name, user_id=user_id, session_id=session_id):
+                    await artifact_service.delete_artifact(app_name=app_name, user_id=user_id, filename=filename, session_id=session_id)
+            await self.runner.session_service.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        except Exception as e:
+            print(f"⚠️ Warning: Could not delete session {session_id}: {e}")
+
+
+job_queue = JobQueue(runner)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_queue.start()
+    yield
+    await job_queue.stop()
+
+
+app = FastAPI(title="MediBill Advocate Agent", lifespan=lifespan)
+
+
+def _job_response(job: Job) -> JobResponse:
+    return JobResponse(
+        job_id=job.id,
+        status=job.status,
+        queue_position=job_queue.queue_position(job),
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        result=job.result,
+        error=job.error,
+    )
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_queue.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(files: list[UploadFile] = File(...), message: str = Form(DEFAULT_MESSAGE)) -> JobResponse:
+    '''
+    Submit a packet of medical documents (bill, EOB, denial letter images or PDFs).
+    Returns the job id to poll or stream.
+    '''
+    parts = []
+    remaining = MAX_UPLOAD_BYTES
+    for upload in files:
+        file_name = os.path.basename(upload.filename or "upload")
+        mime_type = upload.content_type or _get_mime_type(file_name)
+        if mime_type == "application/octet-stream":
+            mime_type = _get_mime_type(file_name)
+        # Read one byte past the remaining budget to detect oversized uploads without loading them
+        data = await upload.read(remaining + 1)
+        if len(data) > remaining:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+        remaining -= len(data)
+        parts.append(types.Part(inline_data=types.Blob(mime_type=mime_type, data=data, display_name=file_name)))
+    parts.append(types.Part(text=message))
+
+    try:
+        job = job_queue.submit(types.Content(role="user", parts=parts))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return _job_response(job)
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str) -> JobResponse:
+    return _job_response(_get_job(job_id))
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str) -> StreamingResponse:
+    '''Stream job progress as server-sent events until the job finishes.'''
+    job = _get_job(job_id)
+
+    async def event_source() -> AsyncIterator[str]:
+        async for event in job.stream():
+            yield f"data: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(event_source(), media_type="text/event-stream")
+
+
+@app.get("/health")
+async def health() -> dict[str, Any]:
+    return {
+        "status": "ok",
+        "running": sum(1 for j in job_queue.jobs.values() if j.status == JobStatus.running),
+        "queued": job_queue.queued,
+        "max_queue_depth": job_queue.max_queue_depth,
+        "concurrency": job_queue.concurrency,
+    }
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# The agent modules create a Gemini client and open the cache and knowledge
+# base on import, so point them somewhere harmless before any test imports them
+_store_dir = tempfile.mkdtemp(prefix="medibill-tests-")
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ.setdefault("MEDIBILL_ANALYSIS_CACHE_PATH", os.path.join(_store_dir, "analysis_cache.sqlite"))
+os.environ.setdefault("MEDIBILL_PRICE_KB_PATH", os.path.join(_store_dir, "price_knowledge_base.sqlite"))
@@ -0,0 +1,117 @@
+import json
+import time
+from types import SimpleNamespace
+
+import google.genai.types as types
+import pytest
+from google.adk.agents import LlmAgent
+
+from orchestrator_agent.analysis_cache import (
+    AnalysisCache,
+    _mask_patient_fields,
+    _unmask_patient_fields,
+    attach_analysis_cache,
+    fingerprint_document,
+)
+
+CHARGE = {
+    "hospital_name": "MidTown Orthopedics",
+    "city": "Springfield",
+    "country": "USA",
+    "code": "99203",
+    "description": "New patient office visit",
+    "billed_amount": 155.0,
+}
+
+
+class TestFingerprintDocument:
+    def test_is_stable(self):
+        assert fingerprint_document(CHARGE) == fingerprint_document(dict(CHARGE))
+
+    def test_ignores_patient_fields(self):
+        assert fingerprint_document({**CHARGE, "patient_name": "A", "claim_number": "1"}) == \
+            fingerprint_document({**CHARGE, "patient_name": "B", "claim_number": "2"})
+
+    def test_ignores_case_whitespace_and_number_format(self):
+        variant = {**CHARGE, "description": "  new PATIENT   office visit ", "billed_amount": 155}
+        assert fingerprint_document(variant) == fingerprint_document(CHARGE)
+
+    def test_ignores_nulls_and_key_order(self):
+        variant = dict(reversed(list({**CHARGE, "policy_name": None}.items())))
+        assert fingerprint_document(variant) == fingerprint_document(CHARGE)
+
+    def test_ignores_line_item_order(self):
+        first = {"charges": [{"code": "1", "amount": 10}, {"code": "2", "amount": 20}]}
+        second = {"charges": [{"code": "2", "amount": 20}, {"code": "1", "amount": 10}]}
+        assert fingerprint_document(first) == fingerprint_document(second)
+
+    @pytest.mark.parametrize("field, value", [("code", "99204"), ("billed_amount", 155.5), ("city", "Shelbyville")])
+    def test_changes_with_the_charge(self, field, value):
+        assert fingerprint_document({**CHARGE, field: value}) != fingerprint_document(CHARGE)
+
+
+class TestPatientFieldMasking:
+    REQUEST = {"patient_id": "000", "claim_number": "12345", "appeal_deadline": "2025-05-01"}
+
+    def test_masks_whole_tokens_only(self):
+        analysis = {
+            "billed": "$1,000",
+            "code": "A000-1",
+            "source": "https://example.com/claims/12345",
+            "note": "Appeal by 2025-05-01. Claim 12345, member 000.",
+        }
+        masked = json.loads(_mask_patient_fields(analysis, self.REQUEST))
+        assert masked["billed"] == "$1,000"
+        assert masked["code"] == "A000-1"
+        assert masked["source"] == "https://example.com/claims/12345"
+        assert masked["note"] == "Appeal by {{appeal_deadline}}. Claim {{claim_number}}, member {{patient_id}}."
+
+    def test_masks_patient_field_keys(self):
+        masked = json.loads(_mask_patient_fields({"appeal_strategy": {"appeal_deadline": "May 1"}}, self.REQUEST))
+        assert masked == {"appeal_strategy": {"appeal_deadline": "{{appeal_deadline}}"}}
+
+    def test_unmask_fills_in_the_new_request(self):
+        stored = _mask_patient_fields({"note": "Claim 12345 by 2025-05-01"}, self.REQUEST)
+        unmasked = json.loads(_unmask_patient_fields(stored, {"claim_number": "C-9"}))
+        assert unmasked == {"note": "Claim C-9 by N/A"}
+
+
+class TestAnalysisCache:
+    def test_put_then_get(self, tmp_path):
+        cache = AnalysisCache(path=str(tmp_path / "cache.sqlite"))
+        cache.put("agent", "v1", "fp", '{"verdict": "Fair"}')
+        assert cache.get("agent", "v1", "fp") == '{"verdict": "Fair"}'
+        assert cache.get("agent", "v2", "fp") is None
+
+    def test_expired_entries_are_not_served_and_purged_on_open(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        cache = AnalysisCache(path=path, ttl_seconds=0.01)
+        cache.put("agent", "v1", "fp", "{}")
+        time.sleep(0.02)
+        assert cache.get("agent", "v1", "fp") is None
+        AnalysisCache(path=path, ttl_seconds=0.01)
+        assert AnalysisCache(path=path).get("agent", "v1", "fp") is None
+
+
+class TestAttachAnalysisCache:
+    @staticmethod
+    def _context(output: str) -> SimpleNamespace:
+        content = types.Content(role="user", parts=[types.Part(text=json.dumps(CHARGE))])
+        return SimpleNamespace(user_content=content, state={"analysis": output})
+
+    def test_stores_only_json_objects_and_serves_hits(self, tmp_path):
+        cache = AnalysisCache(path=str(tmp_path / "cache.sqlite"))
+        agent = attach_analysis_cache(
+            LlmAgent(name="test_agent", model="test-model", instruction="Analyze", output_key="analysis"), cache
+        )
+        before, after = agent.before_agent_callback[-1], agent.after_agent_callback[-1]
+
+        after(self._context("Sorry, I couldn't find prices for this charge."))
+        after(self._context('["not", "an", "object"]'))
+        assert before(self._context("")) is None
+
+        after(self._context('{"verdict": "Fair"}'))
+        context = self._context("")
+        hit = before(context)
+        assert json.loads(hit.parts[0].text) == {"verdict": "Fair"}
+        assert json.loads(context.state["analysis"]) == {"verdict": "Fair"}
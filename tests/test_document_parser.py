@@ -0,0 +1,162 @@
+import json
+
+import pytest
+
+from orchestrator_agent import document_parser_agent
+from orchestrator_agent.document_parser_agent import (
+    _close_truncated_json,
+    _parse_json_response,
+    _parse_json_response_with_truncation,
+    _validate_and_repair,
+    _validate_document,
+)
+
+
+def _bill(**overrides) -> dict:
+    bill = {
+        "document_type": "medical_bill",
+        "hospital_name": "MidTown Orthopedics",
+        "city": "Springfield",
+        "country": "USA",
+        "patient_name": "Test Patient",
+        "date_of_service": "2025-03-22",
+        "charges": [{"code": "99203", "description": "Office visit", "amount": 155.0, "diagnosis_code": "M25.561"}],
+        "total_billed": 155.0,
+        "amount_paid": 0.0,
+        "amount_due": 155.0,
+        "due_date": "2025-04-22",
+    }
+    bill.update(overrides)
+    return bill
+
+
+class TestCloseTruncatedJson:
+    def test_drops_incomplete_trailing_value(self):
+        assert _close_truncated_json('{"a":1,"b":"x') == {"a": 1}
+
+    def test_drops_last_member_of_unclosed_object(self):
+        # Without the closing brace "x" can't be told apart from a cut-off value
+        assert _close_truncated_json('{"a":1,"b":"x"') == {"a": 1}
+
+    def test_closes_nested_brackets(self):
+        text = '[{"code": "99203", "charges": [1, 2]}, {"code": "73560", "charges": [3'
+        assert _close_truncated_json(text) == [{"code": "99203", "charges": [1, 2]}, {"code": "73560"}]
+
+    def test_ignores_brackets_inside_strings(self):
+        assert _close_truncated_json('{"a": "[{", "b": 2, "c": "x') == {"a": "[{", "b": 2}
+
+    def test_handles_escaped_quotes(self):
+        assert _close_truncated_json('{"a": "say \\"hi\\"", "b": "x') == {"a": 'say "hi"'}
+
+    def test_raises_when_nothing_is_recoverable(self):
+        with pytest.raises(json.JSONDecodeError):
+            _close_truncated_json('{"a": "never closed')
+
+
+class TestParseJsonResponse:
+    def test_parses_valid_json(self):
+        assert _parse_json_response('{"a": 1}') == {"a": 1}
+
+    def test_strips_code_fences(self):
+        assert _parse_json_response('```json\n[{"a": 1}]\n```') == [{"a": 1}]
+
+    def test_strips_unterminated_code_fence(self):
+        assert _parse_json_response('```json\n{"a": 1}') == {"a": 1}
+
+    def test_skips_chatter_before_json(self):
+        assert _parse_json_response('Here is the data: {"a": 1}') == {"a": 1}
+
+    def test_recovers_truncated_response(self):
+        assert _parse_json_response('{"a":1,"b":"x"') == {"a": 1}
+
+    def test_raises_on_text_without_json(self):
+        with pytest.raises(json.JSONDecodeError):
+            _parse_json_response("I could not read the document.")
+
+    def test_reports_truncation(self):
+        assert _parse_json_response_with_truncation('```json\n{"a": 1}\n```') == ({"a": 1}, False)
+        assert _parse_json_response_with_truncation('{"a":1,"b":"x"') == ({"a": 1}, True)
+
+
+class TestValidateDocument:
+    def test_valid_document_has_no_problems(self):
+        assert _validate_document(_bill()) == []
+
+    def test_unknown_document_type_is_not_validated(self):
+        assert _validate_document({"document_type": "receipt"}) == []
+
+    def test_reports_missing_field(self):
+        bill = _bill()
+        del bill["city"]
+        assert _validate_document(bill) == [{"field": "city", "error": "city: Field required"}]
+
+    def test_reports_wrong_type_once_per_top_level_field(self):
+        charges = [
+            {"code": "1", "description": "a", "amount": "lots", "diagnosis_code": "x"},
+            {"code": "2", "description": "b", "amount": "more", "diagnosis_code": "y"},
+        ]
+        problems = _validate_document(_bill(charges=charges))
+        assert [p["field"] for p in problems] == ["charges"]
+        assert problems[0]["error"].startswith("charges.0.amount:")
+
+    def test_explicit_null_is_not_a_problem(self):
+        bill = _bill(city=None, due_date=None)
+        bill["charges"][0]["diagnosis_code"] = None
+        assert _validate_document(bill) == []
+
+    def test_charges_that_dont_add_up_to_the_total(self):
+        problems = _validate_document(_bill(total_billed=291.0))
+        assert [p["field"] for p in problems] == ["charges", "total_billed"]
+        assert problems[0]["error"] == "charges: 1 charge(s) sum to 155.00 but total_billed is 291.00"
+
+
+class _FakeClient:
+    """Returns canned responses from generate_content and records the prompts"""
+
+    def __init__(self, *responses: str):
+        self.models = self
+        self.responses = list(responses)
+        self.prompts = []
+
+    def generate_content(self, model, contents):
+        self.prompts.append(contents[0]["parts"][-1]["text"])
+
+        class Response:
+            text = self.responses.pop(0)
+        return Response()
+
+
+class TestTruncatedResponses:
+    def test_field_cut_off_is_repaired_even_if_it_validates(self, monkeypatch):
+        full_charges = _bill()["charges"] + [{"code": "73560", "description": "X-ray", "amount": 79.0, "diagnosis_code": "x"}]
+        client = _FakeClient(json.dumps({"charges": full_charges, "total_billed": 234.0}))
+        monkeypatch.setattr(document_parser_agent, "client", client)
+
+        # The response stopped after the first charge, before the total
+        bill = _bill()
+        del bill["total_billed"]
+        doc = _validate_and_repair(bill, [], cut_field="charges")
+
+        assert "charges" in client.prompts[0]
+        assert doc["charges"] == full_charges
+        assert "validation_issues" not in doc
+
+    def test_failed_repair_of_cut_off_field_is_recorded(self, monkeypatch):
+        monkeypatch.setattr(document_parser_agent, "client", _FakeClient("not json"))
+        doc = _validate_and_repair(_bill(), [], cut_field="charges")
+        assert [i["field"] for i in doc["validation_issues"]] == ["charges"]
+
+    def test_truncated_document_list_is_flagged(self, monkeypatch, tmp_path):
+        (tmp_path / "bill.png").write_bytes(b"\x89PNG")
+        denial_start = '{"document_type": "denial_letter", "insurance_company": "Acme", "denied_services": ["X-ray'
+        client = _FakeClient("[" + json.dumps(_bill()) + ", " + denial_start, "{}")
+        monkeypatch.setattr(document_parser_agent, "client", client)
+
+        result = document_parser_agent._parse_uploaded_documents(str(tmp_path))
+
+        bill, denial = result["documents"]
+        assert "validation_issues" not in bill
+        # Only the denial letter was cut off; the field it stopped in is repaired too
+        assert "insurance_company" in client.prompts[1]
+        assert "denied_services" in [i["field"] for i in denial["validation_issues"]]
+        assert denial["validation_issues"][-1]["field"] == "__response__"
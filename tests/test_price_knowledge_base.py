@@ -0,0 +1,183 @@
+import datetime
+import json
+from types import SimpleNamespace
+
+import google.genai.types as types
+import pytest
+from google.adk.agents import LlmAgent
+
+from orchestrator_agent.price_knowledge_base import (
+    PriceKnowledgeBase,
+    PriceObservation,
+    attach_price_knowledge_base,
+    extract_observations,
+)
+
+CHARGE = {"hospital_name": "MidTown Orthopedics", "city": "Springfield", "country": "USA", "code": "99203",
+          "description": "New patient office visit", "billed_amount": 155.0}
+
+
+def _days_ago(days: int) -> str:
+    return (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+
+
+def _observation(value: float, city: str = "Springfield", source_url: str | None = None, days_old: int = 0,
+                 rate_type: str = "medicare") -> PriceObservation:
+    return PriceObservation(code="99203", city=city, country="USA", rate_type=rate_type, value=value,
+                            source_url=source_url, observed_date=_days_ago(days_old))
+
+
+@pytest.fixture
+def kb(tmp_path) -> PriceKnowledgeBase:
+    return PriceKnowledgeBase(path=str(tmp_path / "kb.sqlite"))
+
+
+class TestLookup:
+    def test_unknown_code_has_no_rates(self, kb):
+        assert kb.lookup("99203", "Springfield", "USA") == []
+
+    def test_prefers_same_city(self, kb):
+        kb.add([_observation(100.0, city="Springfield"), _observation(300.0, city="Shelbyville")])
+        [rate] = kb.lookup(" 99203 ", "SPRINGFIELD ", "usa")
+        assert rate.value == 100.0
+        assert rate.locality == "springfield, usa"
+        assert rate.observations == 1
+
+    def test_falls_back_to_country(self, kb):
+        kb.add([_observation(100.0, city="Springfield"), _observation(300.0, city="Shelbyville")])
+        [rate] = kb.lookup("99203", "Capital City", "USA")
+        assert rate.value == 200.0
+        assert rate.locality == "usa"
+        assert rate.observations == 2
+
+    def test_other_countries_are_ignored(self, kb):
+        kb.add([_observation(100.0)])
+        assert kb.lookup("99203", "Springfield", "Canada") == []
+
+    def test_one_rate_per_rate_type(self, kb):
+        kb.add([_observation(100.0), _observation(150.0, rate_type="commercial")])
+        rates = {r.rate_type: r.value for r in kb.lookup("99203", "Springfield", "USA")}
+        assert rates == {"medicare": 100.0, "commercial": 150.0}
+
+
+class TestScoring:
+    def test_single_local_sourced_observation(self, kb):
+        kb.add([_observation(100.0, source_url="https://example.com/a")])
+        [rate] = kb.lookup("99203", "Springfield", "USA")
+        assert rate.confidence == 0.6  # locality 0.45 + sourced 0.15
+        assert rate.source_urls == ["https://example.com/a"]
+
+    def test_country_fallback_scores_lower(self, kb):
+        kb.add([_observation(100.0)])
+        [rate] = kb.lookup("99203", "Capital City", "USA")
+        assert rate.confidence == 0.3
+
+    def test_corroboration_raises_confidence(self, kb):
+        kb.add([_observation(100.0, source_url=f"https://example.com/{i}") for i in range(5)])
+        [rate] = kb.lookup("99203", "Springfield", "USA")
+        assert rate.confidence == 0.9  # 0.45 + 0.1 x 3 (capped) + 0.15
+
+    def test_disagreement_lowers_confidence(self, kb):
+        kb.add([_observation(100.0), _observation(300.0, source_url="https://example.com/b")])
+        [rate] = kb.lookup("99203", "Springfield", "USA")
+        # median 200, spread 100 / 200 = 0.5: 0.45 + 0.1 + 0.15 - 0.5
+        assert rate.confidence == 0.2
+
+    @pytest.mark.parametrize("days_old, freshness", [(0, 1.0), (180, 0.5), (360, 0.25)])
+    def test_freshness_halves_every_half_life(self, kb, days_old, freshness):
+        kb.add([_observation(100.0, days_old=days_old)])
+        [rate] = kb.lookup("99203", "Springfield", "USA")
+        assert rate.freshness == freshness
+
+    def test_freshness_uses_newest_observation(self, kb):
+        kb.add([_observation(100.0, days_old=360, source_url="https://example.com/old"), _observation(100.0)])
+        [rate] = kb.lookup("99203", "Springfield", "USA")
+        assert rate.freshness == 1.0
+        assert rate.last_observed == _days_ago(0)
+
+
+class TestAdd:
+    def test_re_cited_source_keeps_original_observation(self, kb):
+        assert kb.add([_observation(100.0, source_url="https://example.com/a", days_old=30)]) == 1
+        assert kb.add([_observation(100.0, source_url="https://example.com/a")]) == 0
+        [rate] = kb.lookup("99203", "Springfield", "USA")
+        assert rate.observations == 1
+        assert rate.last_observed == _days_ago(30)
+
+    def test_new_source_is_new_evidence(self, kb):
+        kb.add([_observation(100.0, source_url="https://example.com/a")])
+        assert kb.add([_observation(100.0, source_url="https://example.com/b")]) == 1
+
+    def test_updated_value_from_same_source_replaces_old_one(self, kb):
+        kb.add([_observation(100.0, source_url="https://example.com/a", days_old=400)])
+        assert kb.add([_observation(130.0, source_url="https://example.com/a")]) == 1
+        [rate] = kb.lookup("99203", "Springfield", "USA")
+        assert (rate.value, rate.observations, rate.freshness) == (130.0, 1, 1.0)
+        assert rate.last_observed == _days_ago(0)
+
+    def test_unsourced_observations_are_all_kept(self, kb):
+        kb.add([_observation(100.0, days_old=400)])
+        assert kb.add([_observation(130.0)]) == 1
+        assert kb.add([_observation(130.0)]) == 1
+        [rate] = kb.lookup("99203", "Springfield", "USA")
+        assert (rate.value, rate.observations, rate.freshness) == (130.0, 3, 1.0)
+
+
+class TestExtractObservations:
+    def test_single_procedure(self):
+        analysis = json.dumps({
+            "procedure_code": "99203",
+            "medicare_rate/govt_rate": "$110.50",
+            "medicare_source_url": "https://www.cms.gov/fee-schedule",
+            "commercial_average": "1,150",
+            "commercial_source_url": "not a url",
+        })
+        observations = extract_observations(analysis, CHARGE)
+        assert [(o.rate_type, o.value, o.source_url) for o in observations] == [
+            ("medicare", 110.5, "https://www.cms.gov/fee-schedule"),
+            ("commercial", 1150.0, None),
+        ]
+        assert all(o.city == "Springfield" and o.country == "USA" for o in observations)
+        assert all(o.observed_date == _days_ago(0) for o in observations)
+
+    def test_procedures_list_and_code_fallback(self):
+        analysis = json.dumps({"procedures": [
+            {"medicare_rate/govt_rate": 110.5},
+            {"procedure_code": "73560", "medicare_rate/govt_rate": 40},
+        ]})
+        observations = extract_observations(analysis, CHARGE)
+        assert [(o.code, o.value) for o in observations] == [("99203", 110.5), ("73560", 40.0)]
+
+    @pytest.mark.parametrize("analysis", [
+        "Sorry, no prices found.",
+        json.dumps({"procedure_code": "N/A", "medicare_rate/govt_rate": 100}),
+        json.dumps({"procedure_code": "99203", "medicare_rate/govt_rate": "N/A", "commercial_average": 0}),
+    ])
+    def test_nothing_usable(self, analysis):
+        assert extract_observations(analysis, {}) == []
+
+
+class TestAttachPriceKnowledgeBase:
+    @staticmethod
+    def _context(state: dict) -> SimpleNamespace:
+        content = types.Content(role="user", parts=[types.Part(text=json.dumps(CHARGE))])
+        return SimpleNamespace(user_content=content, state=state)
+
+    def test_served_rates_are_not_recorded_again(self, kb):
+        kb.add([_observation(110.5, source_url="https://example.com/a")])
+        agent = attach_price_knowledge_base(
+            LlmAgent(name="test_agent", model="test-model", instruction="Research", output_key="analysis"), kb
+        )
+        before, after = agent.before_agent_callback[-1], agent.after_agent_callback[-1]
+
+        state = {}
+        before(self._context(state))
+        assert "110.5" in state["known_local_prices"]
+
+        # The agent echoes the served Medicare rate and finds a new commercial rate
+        state["analysis"] = json.dumps({"procedure_code": "99203", "medicare_rate/govt_rate": 110.5,
+                                        "commercial_average": 150.0})
+        after(self._context(state))
+
+        rates = {r.rate_type: r.observations for r in kb.lookup("99203", "Springfield", "USA")}
+        assert rates == {"medicare": 1, "commercial": 1}
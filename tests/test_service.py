@@ -0,0 +1,106 @@
+import asyncio
+
+import google.genai.types as types
+import pytest
+from fastapi.testclient import TestClient
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.sessions import InMemorySessionService
+
+from orchestrator_agent import service
+from orchestrator_agent.service import JobQueue, JobStatus, QueueFullError
+
+
+def _message() -> types.Content:
+    return types.Content(role="user", parts=[types.Part(text="Check my bill")])
+
+
+def test_submit_rejects_jobs_beyond_queue_depth():
+    # Workers aren't started, so submitted jobs stay queued
+    queue = JobQueue(runner=None, max_queue_depth=2)
+    first, second = queue.submit(_message()), queue.submit(_message())
+
+    with pytest.raises(QueueFullError):
+        queue.submit(_message())
+
+    assert queue.queued == 2
+    assert [queue.queue_position(first), queue.queue_position(second)] == [0, 1]
+    assert set(queue.jobs) == {first.id, second.id}
+
+
+def test_post_jobs_returns_429_when_queue_is_full(monkeypatch):
+    monkeypatch.setattr(service, "job_queue", JobQueue(runner=None, max_queue_depth=1))
+    client = TestClient(service.app)
+    files = {"files": ("bill.png", b"\x89PNG", "image/png")}
+
+    accepted = client.post("/jobs", files=files)
+    assert accepted.status_code == 202
+    assert accepted.json()["status"] == JobStatus.queued.value
+    assert accepted.json()["queue_position"] == 0
+
+    rejected = client.post("/jobs", files=files)
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "30"
+    assert "Queue is full" in rejected.json()["detail"]
+
+
+def test_post_jobs_returns_413_for_oversized_uploads(monkeypatch):
+    monkeypatch.setattr(service, "job_queue", JobQueue(runner=None))
+    monkeypatch.setattr(service, "MAX_UPLOAD_BYTES", 10)
+    client = TestClient(service.app)
+
+    # The limit applies to the whole request, not each file
+    files = [("files", ("bill.png", b"x" * 6, "image/png")), ("files", ("eob.png", b"x" * 6, "image/png"))]
+    response = client.post("/jobs", files=files)
+
+    assert response.status_code == 413
+    assert service.job_queue.queued == 0
+    assert client.post("/jobs", files=files[:1]).status_code == 202
+
+
+@pytest.mark.parametrize("value", ["0", "-1"])
+def test_queue_depth_below_one_is_rejected(monkeypatch, value):
+    monkeypatch.setenv("MEDIBILL_MAX_QUEUE_DEPTH", value)
+    with pytest.raises(ValueError, match="MEDIBILL_MAX_QUEUE_DEPTH"):
+        service._positive_int("MEDIBILL_MAX_QUEUE_DEPTH", "20")
+    with pytest.raises(ValueError):
+        JobQueue(runner=None, max_queue_depth=int(value))
+
+
+class _FailingRunner:
+    """Creates a session with an uploaded file, then fails mid-run"""
+
+    app_name = "test_app"
+
+    def __init__(self):
+        self.session_service = InMemorySessionService()
+        self.artifact_service = InMemoryArtifactService()
+
+    async def run_async(self, user_id, session_id, new_message):
+        self.session_id = session_id
+        await self.artifact_service.save_artifact(
+            app_name=self.app_name, user_id=user_id, session_id=session_id, filename="bill.png",
+            artifact=types.Part(inline_data=types.Blob(mime_type="image/png", data=b"\x89PNG")),
+        )
+        raise RuntimeError("model unavailable")
+        yield
+
+
+def test_session_and_artifacts_are_deleted_when_a_job_fails():
+    runner = _FailingRunner()
+
+    async def run_job():
+        queue = JobQueue(runner=runner)
+        job = queue.submit(_message())
+        await queue._run(job)
+        sessions = await runner.session_service.list_sessions(app_name=runner.app_name, user_id=job.id)
+        artifacts = await runner.artifact_service.list_artifact_keys(
+            app_name=runner.app_name, user_id=job.id, session_id=runner.session_id
+        )
+        return job, sessions.sessions, artifacts
+
+    job, sessions, artifacts = asyncio.run(run_job())
+
+    assert job.status == JobStatus.failed
+    assert "model unavailable" in job.error
+    assert sessions == []
+    assert artifacts == []